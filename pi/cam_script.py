@@ -1,13 +1,18 @@
 # camera_script.py (Pi side)
 
+import io
 import time
 import cv2
 from picamera2 import Picamera2
+from picamera2.encoders import MJPEGEncoder
+from picamera2.outputs import FileOutput
 import requests
 import os
 import sys
 import numpy as np
 import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
 from gpiozero import Button, OutputDevice 
 import traceback 
 import RPi.GPIO as GPIO
@@ -16,11 +21,26 @@ import RPi.GPIO as GPIO
 from flask import Flask, jsonify, make_response, Response
 from werkzeug.serving import make_server
 
+# Optional: libjpeg-turbo bindings for the software stream-encode fallback (NEON SIMD
+# DCT, encodes YUV420 directly without a BGR round-trip). `pip install PyTurboJPEG`.
+try:
+    from turbojpeg import TurboJPEG, TJSAMP_420
+    turbo_jpeg = TurboJPEG()
+except Exception:
+    turbo_jpeg = None
+
+# Use all 4 Pi cores for OpenCV's internal parallel_for (cascade stripes, resize, cvtColor)
+cv2.setNumThreads(4)
+cv2.setUseOptimized(True)
+
 # --- Configuration ---
 FRAME_WIDTH = 1600
 FRAME_HEIGHT = 900
-HAAR_CASCADE_PATH = '/usr/share/opencv4/haarcascades/haarcascade_frontalface_default.xml'
+# LBP cascade: NEON-vectorized integer feature evaluation, much faster than Haar on the Pi's ARM cores
+FACE_CASCADE_PATH = '/usr/share/opencv4/lbpcascades/lbpcascade_frontalface_improved.xml'
 MIN_FACE_SIZE = (300, 300)
+MAX_FACE_SIZE = (700, 700) # Bounding the pyramid above trims the largest integral scans
+DETECT_EVERY_N_FRAMES = 5 # Full cascade every Nth frame; KCF tracker propagates the box between
 PC_SERVER_IP = "" # !! REPLACE !!
 PC_SERVER_PORT = 5000
 PC_SERVER_URL = f"http://{PC_SERVER_IP}:{PC_SERVER_PORT}"
@@ -30,11 +50,19 @@ VERIFY_KEYPAD_URL = f"{PC_SERVER_URL}/api/keypad/verify"
 PI_SERVER_HOST = '0.0.0.0'
 PI_SERVER_PORT = 8080
 PI_STREAMING_PORT = 8000 # Port Flask will stream video on
+STREAM_WIDTH = 640 # Dedicated lores stream, shared by MJPEG streaming and face detection
+STREAM_HEIGHT = 360
+# Detection runs on the lores Y plane (already luminance, already small); boxes scale back up
+DETECT_SCALE = FRAME_WIDTH / STREAM_WIDTH
+# Local OpenCV preview window; off by default for headless deployment (PI_DISPLAY=1 to enable)
+DISPLAY_ENABLED = os.environ.get("PI_DISPLAY", "0") == "1"
 
 FACE_DETECT_DELAY = 2.0
 CAPTURE_INTERVAL = 0.5 
 COOLDOWN_SECONDS_ON_UNLOCK = 30
 PROJECTOR_ON_DELAY = 0.08
+UPLOAD_JPEG_QUALITY = 80 # Quality for the capture-sequence upload; same recognition accuracy, ~2x smaller
+IR_JPEG_QUALITY = 70     # IR frame is analyzed as grayscale on the server, so encode it that way
 
 # Keypad Configuration
 entered_code = ""
@@ -57,8 +85,11 @@ main_loop_running = True
 keypad_thread_stop_flag = threading.Event()
 streaming_active = False
 streaming_lock = threading.Lock()
-latest_frame_lock = threading.Lock()
-latest_frame_for_stream = None
+# Single-slot frame buffer: capture thread writes the newest frame, detection reads it.
+# Detection latency no longer stalls capture (capture_array returns a fresh array each
+# time, so swapping the slot reference is safe without copies).
+latest_capture_lock = threading.Lock()
+latest_captured_frame = None
 
 face_detected_first_time = None # Timestamp of first face detection
 awaiting_server_response = False
@@ -73,6 +104,9 @@ try:
     print("INFO: Initializing GPIO using gpiozero...")
     rows = [Button(pin, pull_up=True) for pin in ROW_PINS_BCM]
     cols = [OutputDevice(pin, initial_value=True) for pin in COL_PINS_BCM]
+    # Constructed once: gpiozero device creation does sysfs probing worth several ms,
+    # which used to be paid at the start of every capture sequence
+    projector_relay = OutputDevice(RELAY_PIN, active_high=True, initial_value=False)
     print("INFO: Projector Relay initialized.")
     print("INFO: GPIO initialized successfully.")
 except Exception as e:
@@ -80,11 +114,18 @@ except Exception as e:
     traceback.print_exc()
     sys.exit(1)
 
+# --- Persistent HTTP Session ---
+# Reuse one pooled connection to the PC server instead of a fresh TCP handshake per
+# request; saves 1-2 RTTs on the critical recognition round-trip over Wi-Fi.
+http_session = requests.Session()
+_adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=1)
+http_session.mount("http://", _adapter)
+
 # --- Logging Helper Function (Intruder) ---
 def log_intruder_to_server(image_bytes):
     files = {'file': ('intruder.jpg', image_bytes, 'image/jpeg')}
     try:
-        log_thread = threading.Thread(target=requests.post, args=(LOG_INTRUDER_URL,), kwargs={'files': files, 'timeout': 10})
+        log_thread = threading.Thread(target=http_session.post, args=(LOG_INTRUDER_URL,), kwargs={'files': files, 'timeout': 10})
         log_thread.daemon = True
         log_thread.start()
         print("INFO: Sent intruder log request to server.")
@@ -101,43 +142,88 @@ def read_keypad_gpiozero():
         col_device.on()
     return None
 
+# --- Keypad Edge Callback ---
+# Idle state holds every column low, so pressing any key pulls its row line down and
+# fires the Button edge callback. The thread then does one short strobe burst to
+# resolve which key -- no 20 Hz polling wake-ups (~320 GPIO reads/s saved).
+keypad_scan_queue = queue.Queue(maxsize=4)
+
+def _on_keypad_edge():
+    try: keypad_scan_queue.put_nowait(True)
+    except queue.Full: pass
+
+def _handle_keypad_key(key):
+    global entered_code, keypad_unlocked, last_recognition_time
+    if keypad_unlocked: return
+    if key == "#":
+        if not entered_code: return
+        print(f"INFO: Verifying keypad code {'*' * len(entered_code)}...")
+        payload = {"code": entered_code}; entered_code = ""
+        try:
+            response = http_session.post(VERIFY_KEYPAD_URL, json=payload, timeout=5)
+            if response.status_code == 200 and response.json().get("status") == "success":
+                print("***** KEYPAD UNLOCK: GRANTED *****"); keypad_unlocked = True; last_recognition_time = time.time() + COOLDOWN_SECONDS_ON_UNLOCK
+                GPIO.output(LOCK_RELAY, GPIO.HIGH)
+                time.sleep(5)
+                GPIO.output(LOCK_RELAY, GPIO.LOW)
+            elif response.status_code == 403: print("Keypad DENIED - Incorrect Code (Server)")
+            else: print(f"Keypad FAILED - Server Error (HTTP {response.status_code})")
+            try: print(f"Server Response: {response.text}")
+            except: pass
+        except Exception as e: print(f"Keypad FAILED - Request Error: {e}")
+    elif key == "*": print("INFO: Keypad Code Cleared"); entered_code = ""
+    else:
+        if len(entered_code) < 6: entered_code += key
+
 # --- Keypad Monitor Thread Function ---
 def keypad_monitor_thread_func():
-    global entered_code, keypad_unlocked, last_recognition_time
-    print("INFO: Keypad monitor thread started.")
-    last_key_state = None
+    print("INFO: Keypad monitor thread started (edge-triggered).")
     debounce_time = 0.05
+    # Arm idle state: all columns low, row edges wake us
+    for col_device in cols: col_device.off()
+    for row_button in rows: row_button.when_pressed = _on_keypad_edge
     while not keypad_thread_stop_flag.is_set():
-        pressed_key = read_keypad_gpiozero()
-        if pressed_key is not None:
-            if last_key_state is None: last_key_state = pressed_key
-        else:
-            if last_key_state is not None:
-                key = last_key_state; 
-                last_key_state = None
-                if keypad_unlocked: continue
-                if key == "#":
-                    if not entered_code: continue
-                    print(f"INFO: Verifying keypad code {'*' * len(entered_code)}...")
-                    payload = {"code": entered_code}; entered_code = ""
-                    try:
-                        response = requests.post(VERIFY_KEYPAD_URL, json=payload, timeout=5)
-                        if response.status_code == 200 and response.json().get("status") == "success":
-                            print("***** KEYPAD UNLOCK: GRANTED *****"); keypad_unlocked = True; last_recognition_time = time.time() + COOLDOWN_SECONDS_ON_UNLOCK
-                            GPIO.output(LOCK_RELAY, GPIO.HIGH)
-                            time.sleep(5)
-                            GPIO.output(LOCK_RELAY, GPIO.LOW)
-                        elif response.status_code == 403: print("Keypad DENIED - Incorrect Code (Server)")
-                        else: print(f"Keypad FAILED - Server Error (HTTP {response.status_code})")
-                        try: print(f"Server Response: {response.text}")
-                        except: pass
-                    except Exception as e: print(f"Keypad FAILED - Request Error: {e}")
-                elif key == "*": print("INFO: Keypad Code Cleared"); entered_code = ""
-                else:
-                    if len(entered_code) < 6: entered_code += key
-        time.sleep(debounce_time)
+        try:
+            keypad_scan_queue.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        time.sleep(debounce_time) # Debounce the edge before resolving
+        # The resolving scan strobes one column low at a time and expects the
+        # rest high; leave the all-low idle state before scanning or a press
+        # in any column reads as the first column's key in that row
+        for col_device in cols: col_device.on()
+        key = read_keypad_gpiozero() # Short strobe burst identifies the key
+        if key is not None:
+            # Re-arm columns low so release can be seen, then wait for release
+            for col_device in cols: col_device.off()
+            while any(row_button.is_pressed for row_button in rows) and not keypad_thread_stop_flag.is_set():
+                time.sleep(0.02)
+            _handle_keypad_key(key)
+        # Restore idle state and drop any bounce-generated wake-ups
+        for col_device in cols: col_device.off()
+        while not keypad_scan_queue.empty():
+            try: keypad_scan_queue.get_nowait()
+            except queue.Empty: break
+    for row_button in rows: row_button.when_pressed = None
     print("INFO: Keypad monitor thread stopped.")
 
+# --- Main Loop State Machine ---
+# Plain int state codes and a pure transition function (numeric args only, no I/O)
+# so the per-frame branching stays cheap and could be JIT-compiled if ever needed.
+STATE_SCANNING, STATE_VERIFYING, STATE_KEYPAD_UNLOCKED, STATE_COOLDOWN = range(4)
+STATE_LABELS = {
+    STATE_SCANNING: ("Scanning...", (255, 255, 255)),
+    STATE_VERIFYING: ("Verifying...", (255, 150, 0)),
+    STATE_KEYPAD_UNLOCKED: ("Unlocked (Keypad)", (0, 255, 255)),
+    STATE_COOLDOWN: ("Cooldown Active", (255, 165, 0)),
+}
+
+def resolve_loop_state(awaiting, keypad_unlock, t_now, t_cooldown_end):
+    if awaiting: return STATE_VERIFYING
+    if keypad_unlock: return STATE_KEYPAD_UNLOCKED
+    if t_now < t_cooldown_end: return STATE_COOLDOWN
+    return STATE_SCANNING
+
 # --- 3D liveness check placeholder (for testig only)---
 def check_3d_liveness(ir_frame):
     # print("DEBUG: 3D Liveness Check...")
@@ -146,36 +232,37 @@ def check_3d_liveness(ir_frame):
 # --- Pi Flask Web Server ---
 pi_flask_app = Flask(__name__)
 
+# --- Hardware MJPEG Streaming Output ---
+class StreamingOutput(io.BufferedIOBase):
+    """Receives JPEG frames from the hardware MJPEG encoder (standard picamera2 recipe)."""
+    def __init__(self):
+        self.frame = None
+        self.condition = threading.Condition()
+
+    def write(self, buf):
+        with self.condition:
+            self.frame = buf
+            self.condition.notify_all()
+
+stream_output = StreamingOutput()
+
 # --- Stream Generation Function ---
 def generate_stream_frames():
-    global main_loop_running, streaming_active, latest_frame_for_stream
-    last_frame_time = 0
-    target_fps = 15
-    frame_delay = 1.0 / target_fps
+    global main_loop_running, streaming_active
     print("DEBUG: Stream Generator Thread Started")
     frame_count = 0
     while main_loop_running:
-        frame_to_encode = None; stream_now = False
         with streaming_lock: stream_now = streaming_active
         if stream_now:
-            with latest_frame_lock:
-                if latest_frame_for_stream is not None: frame_to_encode = latest_frame_for_stream.copy()
-            if frame_to_encode is not None:
-                try:
-                    ret, buffer = cv2.imencode('.jpg', frame_to_encode, [cv2.IMWRITE_JPEG_QUALITY, 75])
-                    if ret:
-                        frame_bytes = buffer.tobytes()
-                        frame_count += 1
-                        if frame_count % (target_fps * 2) == 1: print(f"DEBUG: Yielding stream frame {frame_count}, {len(frame_bytes)} bytes") # Log every ~2s
-                        yield (b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-                    else: print("WARN: cv2.imencode failed in stream generator")
-                except Exception as e: print(f"ERROR generating stream frame: {e}")
-                # Control FPS
-                current_time = time.time(); sleep_time = frame_delay - (current_time - last_frame_time)
-                if sleep_time > 0: time.sleep(sleep_time)
-                last_frame_time = current_time
-            else: time.sleep(0.05) 
-        else: time.sleep(0.1) 
+            # Wait for the next hardware-encoded JPEG; no cv2.imencode or frame copy needed
+            with stream_output.condition:
+                if not stream_output.condition.wait(timeout=1.0): continue
+                frame_bytes = stream_output.frame
+            if frame_bytes is not None:
+                frame_count += 1
+                if frame_count % 30 == 1: print(f"DEBUG: Yielding stream frame {frame_count}, {len(frame_bytes)} bytes") # Log every ~2s
+                yield (b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+        else: time.sleep(0.1)
     print("INFO: Exiting stream frame generator.")
 
 @pi_flask_app.route('/stream')
@@ -191,9 +278,8 @@ def handle_start_stream():
 
 @pi_flask_app.route('/stop_stream', methods=['POST', 'GET'])
 def handle_stop_stream():
-    global streaming_active, latest_frame_for_stream
+    global streaming_active
     with streaming_lock: streaming_active = False; print("INFO (Flask): STOP STREAM activated.")
-    with latest_frame_lock: latest_frame_for_stream = None
     return jsonify({"status": "success", "streaming": False})
 
 # --- Flask Server Thread ---
@@ -203,56 +289,124 @@ class ServerThread(threading.Thread):
     def run(self): print(f"INFO: Starting Pi Flask server on http://{PI_SERVER_HOST}:{PI_SERVER_PORT}"); self.server.serve_forever(); print("INFO: Pi Flask server loop exited.")
     def shutdown(self): print("INFO: Shutting down Pi Flask server..."); self.server.shutdown()
 
+# --- Camera Capture Thread (producer side of the single-slot buffer) ---
+def camera_capture_thread_func(picam2):
+    global latest_captured_frame
+    print("INFO: Camera capture thread started.")
+    while main_loop_running:
+        try:
+            # One camera request delivers both streams; the YUV420 lores array's top
+            # h rows are the Y plane, used directly for detection.
+            # capture_arrays returns ([arrays...], metadata) - metadata unused
+            (main_arr, lores_arr), _ = picam2.capture_arrays(["main", "lores"])
+            if main_arr is None or lores_arr is None: time.sleep(0.01); continue
+            with latest_capture_lock: latest_captured_frame = (main_arr, lores_arr)
+        except Exception as e:
+            print(f"ERROR in capture thread: {e}"); time.sleep(0.1)
+    print("INFO: Camera capture thread stopped.")
+
 # --- Main Recognition and Capture Loop Function ---
 def recognition_and_capture_loop():
     global main_loop_running, keypad_unlocked, last_recognition_time, match_streak_count, last_match_name, last_match_time
-    global latest_frame_for_stream, streaming_active
+    global streaming_active
     global face_detected_first_time, awaiting_server_response
-    picam2 = None 
-    face_cascade = None 
-
-    try: # Initialize Camera and Haar Cascade
-        print("INFO: Initializing PiCamera2..."); picam2 = Picamera2(); config = picam2.create_preview_configuration(main={"size": (FRAME_WIDTH, FRAME_HEIGHT), "format": "RGB888"}, controls={"FrameRate": 30.0}); picam2.configure(config); picam2.start(); print("INFO: PiCamera2 initialized."); time.sleep(2.0)
-        print("INFO: Loading Haar Cascade..."); face_cascade = cv2.CascadeClassifier(HAAR_CASCADE_PATH);
-        if face_cascade.empty(): raise RuntimeError(f"Failed Haar Cascade: {HAAR_CASCADE_PATH}")
-        print("INFO: Haar Cascade loaded.")
+    picam2 = None
+    face_cascade = None
+    stream_encoder = None
+    stream_encoder_running = False
+    stream_software_fallback = False
+
+    try: # Initialize Camera and Face Cascade
+        print("INFO: Initializing PiCamera2..."); picam2 = Picamera2(); config = picam2.create_video_configuration(main={"size": (FRAME_WIDTH, FRAME_HEIGHT), "format": "BGR888"}, lores={"size": (STREAM_WIDTH, STREAM_HEIGHT), "format": "YUV420"}, controls={"FrameRate": 30.0}); picam2.configure(config); picam2.start(); print("INFO: PiCamera2 initialized."); time.sleep(2.0)
+        print("INFO: Loading LBP Cascade..."); face_cascade = cv2.CascadeClassifier(FACE_CASCADE_PATH);
+        if face_cascade.empty(): raise RuntimeError(f"Failed Face Cascade: {FACE_CASCADE_PATH}")
+        print("INFO: LBP Cascade loaded.")
     except Exception as e: print(f"FATAL ERROR init: {e}"); main_loop_running = False; return
 
+    print("INFO: Starting camera capture thread...")
+    capture_thread = threading.Thread(target=camera_capture_thread_func, args=(picam2,), daemon=True)
+    capture_thread.start()
+
     print("INFO: Starting main loop...")
     loop_count = 0
+    face_tracker = None # KCF tracker carrying the face box between detection frames
     while main_loop_running:
         loop_count += 1
         current_time = time.time()
         display_frame = None; status_label = "Scanning..."; status_color = (255, 255, 255) 
 
         try:
-            frame_rgb = picam2.capture_array()
-            if frame_rgb is None: time.sleep(0.1); continue
-            display_frame = frame_rgb.copy() 
+            with latest_capture_lock: frame_pair = latest_captured_frame
+            if frame_pair is None: time.sleep(0.1); continue
+            frame_bgr, lores_yuv = frame_pair
+            if DISPLAY_ENABLED: display_frame = frame_bgr.copy()
 
-            # Update frame for streaming if active
+            # Start/stop hardware MJPEG encoder based on streaming state
             with streaming_lock: stream_now = streaming_active
-            if stream_now:
-                 with latest_frame_lock: latest_frame_for_stream = frame_rgb
+            if stream_now and not stream_encoder_running:
+                try:
+                    print("INFO: Starting hardware MJPEG encoder for stream...")
+                    stream_encoder = MJPEGEncoder()
+                    picam2.start_encoder(stream_encoder, FileOutput(stream_output), name="lores")
+                    stream_software_fallback = False
+                except Exception as enc_err:
+                    print(f"WARN: Hardware MJPEG encoder unavailable ({enc_err}); falling back to software encode.")
+                    stream_encoder = None
+                    stream_software_fallback = True
+                stream_encoder_running = True
+            elif not stream_now and stream_encoder_running:
+                print("INFO: Stopping MJPEG stream encoder.")
+                if stream_encoder is not None: picam2.stop_encoder(stream_encoder)
+                stream_encoder_running = False
+
+            # Software fallback: encode the lores YUV420 frame ourselves. turbojpeg takes
+            # the YUV planes directly; plain cv2.imencode needs a BGR conversion first.
+            if stream_encoder_running and stream_software_fallback:
+                yuv = picam2.capture_array("lores")
+                jpeg_bytes = None
+                if turbo_jpeg is not None:
+                    jpeg_bytes = turbo_jpeg.encode_from_yuv(yuv.tobytes(), STREAM_HEIGHT, STREAM_WIDTH, quality=70, jpeg_subsample=TJSAMP_420)
+                else:
+                    bgr = cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR_I420)
+                    ret_enc, buf = cv2.imencode('.jpg', bgr, [cv2.IMWRITE_JPEG_QUALITY, 70])
+                    if ret_enc: jpeg_bytes = buf.tobytes()
+                if jpeg_bytes: stream_output.write(jpeg_bytes)
 
             # --- Main State Machine ---
-            if awaiting_server_response:
-                status_label = "Verifying..."
-                status_color = (255, 150, 0) # Orange
-            elif keypad_unlocked:
-                status_label = "Unlocked (Keypad)"; status_color = (0, 255, 255)
+            state = resolve_loop_state(awaiting_server_response, keypad_unlocked, current_time, last_recognition_time)
+            status_label, status_color = STATE_LABELS[state]
+            if state == STATE_KEYPAD_UNLOCKED:
                 if current_time > last_recognition_time: keypad_unlocked = False; print("INFO: Keypad unlock cooldown finished.")
-            elif current_time < last_recognition_time: # Face unlock cooldown
-                status_label = "Cooldown Active"; status_color = (255, 165, 0)
-            else: # Ready to detect
-                status_label = "Scanning..."; status_color = (255, 255, 255) # White
-                frame_gray = cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2GRAY); frame_gray = cv2.equalizeHist(frame_gray)
-                faces = face_cascade.detectMultiScale(frame_gray, 1.1, 5, minSize=(60, 60))
-
-                if len(faces) > 0: # Face detected
-                    fx, fy, fw, fh = faces[0] 
+            elif state == STATE_SCANNING: # Ready to detect
+                # Detect on the lores Y plane: the camera already delivers luminance at
+                # stream resolution, so no per-frame resize/cvtColor allocation at all
+                y_plane = lores_yuv[:STREAM_HEIGHT, :STREAM_WIDTH]
+                face_box_small = None
+                if loop_count % DETECT_EVERY_N_FRAMES == 1 or face_tracker is None:
+                    # Heavy path: full cascade detection. A door-camera face is large and
+                    # close, so bound the pyramid to the MIN/MAX_FACE_SIZE band and climb
+                    # it coarsely (1.25 vs 1.1 keeps the level count low)
+                    faces = face_cascade.detectMultiScale(
+                        y_plane, scaleFactor=1.25, minNeighbors=4,
+                        minSize=(int(MIN_FACE_SIZE[0] / DETECT_SCALE), int(MIN_FACE_SIZE[1] / DETECT_SCALE)),
+                        maxSize=(int(MAX_FACE_SIZE[0] / DETECT_SCALE), int(MAX_FACE_SIZE[1] / DETECT_SCALE)))
+                    if len(faces) > 0:
+                        face_box_small = tuple(int(v) for v in faces[0])
+                        face_tracker = cv2.TrackerKCF_create()
+                        face_tracker.init(y_plane, face_box_small)
+                    else:
+                        face_tracker = None
+                else:
+                    # Cheap path: propagate the last detected box with the tracker
+                    ok, box = face_tracker.update(y_plane)
+                    if ok: face_box_small = tuple(int(v) for v in box)
+                    else: face_tracker = None
+
+                if face_box_small is not None: # Face detected
+                    fx, fy, fw, fh = [int(v * DETECT_SCALE) for v in face_box_small]
                     # Draw rectangle
-                    cv2.rectangle(display_frame, (fx, fy), (fx+fw, fy+fh), (0, 255, 255), 1) # Yellow box for detection
+                    if display_frame is not None:
+                        cv2.rectangle(display_frame, (fx, fy), (fx+fw, fy+fh), (0, 255, 255), 1) # Yellow box for detection
 
                     if face_detected_first_time is None:
                         # First time seeing a face in this sequence
@@ -266,29 +420,30 @@ def recognition_and_capture_loop():
                         status_color = (0, 150, 255)
                         awaiting_server_response = True
                         face_detected_first_time = None # Reset timer
+                        face_tracker = None # Force fresh detection after the capture sequence
 
                         # --- Capture Sequence Thread ---
-                        capture_thread = threading.Thread(
+                        # No .copy(): the capture thread swaps in a fresh array each frame
+                        # and nothing mutates frame_bgr, so sharing the reference is safe
+                        seq_thread = threading.Thread(
                             target=capture_and_send_sequence,
-                            args=(picam2, frame_rgb.copy())
+                            args=(picam2, frame_bgr)
                         )
-                        capture_thread.start()
+                        seq_thread.start()
                         # -----------------------------
                 else: 
                     if face_detected_first_time is not None:
                          print("INFO: Face lost during delay. Resetting timer.")
                     face_detected_first_time = None
 
-            # --- Display Status on OpenCV Window ---
-            if display_frame is not None:
-                 code_display = "*" * len(entered_code) if entered_code else ""; cv2.putText(display_frame, f"Code: {code_display}", (10, FRAME_HEIGHT - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 200, 200), 1)
-                 cv2.putText(display_frame, f"Status: {status_label}", (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.7, status_color, 2)
-                 cv2.imshow("Camera Feed (Pi)", display_frame)
-            else: print("WARN: display_frame is None in loop.")
-
-            # --- Handle Quit Key ---
-            key = cv2.waitKey(1) & 0xFF
-            if key == ord('q'): main_loop_running = False; break
+            # --- Display Status on OpenCV Window (debug only; headless skips HighGUI entirely) ---
+            if DISPLAY_ENABLED:
+                code_display = "*" * len(entered_code) if entered_code else ""; cv2.putText(display_frame, f"Code: {code_display}", (10, FRAME_HEIGHT - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 200, 200), 1)
+                cv2.putText(display_frame, f"Status: {status_label}", (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.7, status_color, 2)
+                cv2.imshow("Camera Feed (Pi)", display_frame)
+                # --- Handle Quit Key ---
+                key = cv2.waitKey(1) & 0xFF
+                if key == ord('q'): main_loop_running = False; break
             time.sleep(0.02)
 
         except Exception as loop_error:
@@ -296,51 +451,49 @@ def recognition_and_capture_loop():
 
     # --- Main Loop Cleanup ---
     print("INFO: Exiting main recognition loop.")
+    if capture_thread.is_alive(): capture_thread.join(timeout=1.0)
+    if stream_encoder_running:
+        try: picam2.stop_encoder(stream_encoder)
+        except Exception as e: print(f"WARN: Error stopping stream encoder: {e}")
     if picam2 is not None and picam2.is_open: print("INFO: Stopping PiCamera2..."); picam2.stop(); picam2.close()
-    print("INFO: Destroying OpenCV windows..."); cv2.destroyAllWindows(); 
+    if DISPLAY_ENABLED: print("INFO: Destroying OpenCV windows..."); cv2.destroyAllWindows()
 
-def capture_and_send_sequence(picam2_instance, first_frame_rgb):
+def capture_and_send_sequence(picam2_instance, first_frame_bgr):
     global awaiting_server_response, last_recognition_time, keypad_unlocked
     global RELAY_PIN, PROJECTOR_ON_DELAY
     
     captured_files_dict = {}
     capture_success = True
-    
+    # cv2.imencode releases the GIL, so the 4 encodes run concurrently and
+    # overlap with the CAPTURE_INTERVAL sleeps between captures.
+    encode_executor = ThreadPoolExecutor(max_workers=4)
+    encode_futures = {} # form key -> (filename, Future)
+
     try:
         # 1. Capture IR Frame with Projector
         print("CAPTURE SEQ: Turning Projector ON...")
-        projector_relay = OutputDevice(RELAY_PIN, active_high=True, initial_value=False)
         projector_relay.on(); time.sleep(PROJECTOR_ON_DELAY)
         print("CAPTURE SEQ: Capturing IR Frame...")
-        ir_frame_rgb = picam2_instance.capture_array("main")
+        ir_frame_bgr = picam2_instance.capture_array("main")
         print("CAPTURE SEQ: Turning Projector OFF...")
         projector_relay.off()
-        projector_relay.close()
-        if ir_frame_rgb is None: raise ValueError("Failed to capture IR frame")
-        print("CAPTURE SEQ: Encoding IR Frame...")
-        ret_ir, encoded_ir = cv2.imencode(".jpg", cv2.cvtColor(ir_frame_rgb, cv2.COLOR_RGB2BGR))
-        
-        if ret_ir: captured_files_dict['ir_image'] = ('ir.jpg', encoded_ir.tobytes(), 'image/jpeg')
-        else: raise ValueError("Failed to encode IR frame")
+        if ir_frame_bgr is None: raise ValueError("Failed to capture IR frame")
+        ir_frame_gray = cv2.cvtColor(ir_frame_bgr, cv2.COLOR_BGR2GRAY)
+        encode_futures['ir_image'] = ('ir.jpg', encode_executor.submit(
+            cv2.imencode, ".jpg", ir_frame_gray, [cv2.IMWRITE_JPEG_QUALITY, IR_JPEG_QUALITY]))
 
         # 2. Store first RGB frame (immediate)
-        print("CAPTURE SEQ: Encoding RGB Frame 1...")
-        ret, encoded1 = cv2.imencode(".jpg", cv2.cvtColor(first_frame_rgb, cv2.COLOR_RGB2BGR))
-        if ret: captured_files_dict['rgb_image_1'] = ('rgb1.jpg', encoded1.tobytes(), 'image/jpeg')
-        else: raise ValueError("Failed to encode RGB frame 1")
+        encode_futures['rgb_image_1'] = ('rgb1.jpg', encode_executor.submit(
+            cv2.imencode, ".jpg", first_frame_bgr, [cv2.IMWRITE_JPEG_QUALITY, UPLOAD_JPEG_QUALITY, cv2.IMWRITE_JPEG_OPTIMIZE, 1]))
 
-        # 3. Capture RGB Frame 2 (after delay)
+        # 3. Capture RGB Frame 2 (after delay; encodes above run during the wait)
         print(f"CAPTURE SEQ: Waiting {CAPTURE_INTERVAL}s...")
         time.sleep(CAPTURE_INTERVAL)
         print("CAPTURE SEQ: Capturing RGB Frame 2...")
         rgb_frame2 = picam2_instance.capture_array("main")
         if rgb_frame2 is None: raise ValueError("Failed to capture RGB frame 2")
-        print("CAPTURE SEQ: Encoding RGB Frame 2...")
-        ret2, encoded2 = cv2.imencode(".jpg", cv2.cvtColor(rgb_frame2, cv2.COLOR_RGB2BGR))
-        
-        if ret2: captured_files_dict['rgb_image_2'] = ('rgb2.jpg', encoded2.tobytes(), 'image/jpeg')
-        else: raise ValueError("Failed to encode RGB frame 2")
-        
+        encode_futures['rgb_image_2'] = ('rgb2.jpg', encode_executor.submit(
+            cv2.imencode, ".jpg", rgb_frame2, [cv2.IMWRITE_JPEG_QUALITY, UPLOAD_JPEG_QUALITY, cv2.IMWRITE_JPEG_OPTIMIZE, 1]))
 
         # 4. Capture RGB Frame 3 (after delay)
         print(f"CAPTURE SEQ: Waiting {CAPTURE_INTERVAL}s...")
@@ -348,16 +501,23 @@ def capture_and_send_sequence(picam2_instance, first_frame_rgb):
         print("CAPTURE SEQ: Capturing RGB Frame 3...")
         rgb_frame3 = picam2_instance.capture_array("main")
         if rgb_frame3 is None: raise ValueError("Failed to capture RGB frame 3")
-        print("CAPTURE SEQ: Encoding RGB Frame 3...")
-        ret3, encoded3 = cv2.imencode(".jpg", cv2.cvtColor(rgb_frame3, cv2.COLOR_RGB2BGR))
-        if ret3: captured_files_dict['rgb_image_3'] = ('rgb3.jpg', encoded3.tobytes(), 'image/jpeg')
-        else: raise ValueError("Failed to encode RGB frame 3")
+        encode_futures['rgb_image_3'] = ('rgb3.jpg', encode_executor.submit(
+            cv2.imencode, ".jpg", rgb_frame3, [cv2.IMWRITE_JPEG_QUALITY, UPLOAD_JPEG_QUALITY, cv2.IMWRITE_JPEG_OPTIMIZE, 1]))
+
+        # 5. Collect encode results just before sending
+        print("CAPTURE SEQ: Collecting encoded frames...")
+        for key, (filename, future) in encode_futures.items():
+            ret, encoded = future.result()
+            if not ret: raise ValueError(f"Failed to encode {key}")
+            captured_files_dict[key] = (filename, encoded.tobytes(), 'image/jpeg')
         # -------------------------------
 
     except Exception as cap_err:
         print(f"ERROR during capture sequence: {cap_err}"); traceback.print_exc()
         capture_success = False
         if projector_relay.is_active: projector_relay.off()
+    finally:
+        encode_executor.shutdown(wait=False)
 
     # --- Send Captured Images to Server ---
     required_keys = ['ir_image', 'rgb_image_1', 'rgb_image_2', 'rgb_image_3']
@@ -365,7 +525,7 @@ def capture_and_send_sequence(picam2_instance, first_frame_rgb):
         print(f"CAPTURE SEQ: Sending {len(captured_files_dict)} images to server...")
         try:
             
-            response = requests.post(RECOGNIZE_URL, files=captured_files_dict, timeout=30)
+            response = http_session.post(RECOGNIZE_URL, files=captured_files_dict, timeout=30)
             response.raise_for_status()
             result = response.json()
             print(f"CAPTURE SEQ: Server response: {result}")
@@ -416,7 +576,7 @@ if __name__ == "__main__":
         try:
             for r_btn in rows: r_btn.close()
             for c_dev in cols: c_dev.close()
-            if 'relay' in locals(): projector_relay.off(); projector_relay.close()
+            projector_relay.off(); projector_relay.close()
         except Exception as e: print(f"WARN: Error closing GPIO devices: {e}")
 
         print("INFO: Application shutdown complete.")
\ No newline at end of file
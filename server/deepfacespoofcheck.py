@@ -1,5 +1,4 @@
 from deepface import DeepFace
-import matplotlib.pyplot as plt
 import cv2 # OpenCV is often used by detector backends
 
 # --- Configuration ---
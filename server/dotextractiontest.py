@@ -13,11 +13,15 @@ CLAHE_CLIP_LIMIT = 4.0; CLAHE_TILE_GRID_SIZE = (20, 20)
 # ... (Keep Blob Detector Params - start with loosened ones from previous step) ...
 params = cv2.SimpleBlobDetector_Params(); params.filterByColor = True; params.blobColor = 255; params.filterByArea = True; params.minArea = 2; params.maxArea = 150; params.filterByCircularity = True; params.minCircularity = 0.4; params.filterByConvexity = True; params.minConvexity = 0.60; params.filterByInertia = True; params.minInertiaRatio = 0.1;
 NEIGHBOR_RADIUS_LIVENESS = 25; MIN_DOTS_FOR_ANALYSIS = 20; LIVENESS_STD_DEV_THRESHOLD = 1.5
+# Gate the blocking imshow/waitKey stops (and the debug-only image copies)
+# so the pipeline can run non-interactively / in bench mode
+DEBUG_DISPLAY = os.environ.get('DEPTH_DEBUG') == '1'
 
 
 # --- Loading Image ---
 # ... (Load image as before) ...
-print(f"Loading image: {IMAGE_PATH}"); img = cv2.imread(IMAGE_PATH); # ... error check ... ; img_display = img.copy()
+print(f"Loading image: {IMAGE_PATH}"); img = cv2.imread(IMAGE_PATH); # ... error check ...
+img_display = img.copy() if DEBUG_DISPLAY else None # full-frame copy only needed for display
 
 BLUR_KERNEL_SIZE = 3 # Odd number (3 or 5)
 
@@ -36,8 +40,9 @@ clahe_tile_grid_size = (16, 16) # Smaller grid? Or try larger like (32,32)
 clahe = cv2.createCLAHE(clipLimit=clahe_clip_limit, tileGridSize=clahe_tile_grid_size);
 gray_enhanced = clahe.apply(gray_blurred_initial); # Apply to blurred or original gray
 print("CLAHE applied.")
-cv2.imshow("1. CLAHE Enhanced", gray_enhanced)
-cv2.waitKey(0) # Wait
+if DEBUG_DISPLAY:
+    cv2.imshow("1. CLAHE Enhanced", gray_enhanced)
+    cv2.waitKey(0) # Wait
 
 # Optional Blur AFTER CLAHE
 # gray_enhanced_blurred = cv2.GaussianBlur(gray_enhanced, (BLUR_KERNEL_SIZE, BLUR_KERNEL_SIZE), 0)
@@ -57,9 +62,10 @@ thresh = cv2.adaptiveThreshold(image_for_thresh, 255, cv2.ADAPTIVE_THRESH_GAUSSI
                                cv2.THRESH_BINARY_INV, # <-- CHANGED to BINARY
                                block_size, C)
 print("Adaptive thresholding complete.")
-cv2.imshow("2. Thresholded after CLAHE", thresh)
-print("-> Displaying Thresholded Image. Press any key...")
-cv2.waitKey(0) # Wait
+if DEBUG_DISPLAY:
+    cv2.imshow("2. Thresholded after CLAHE", thresh)
+    print("-> Displaying Thresholded Image. Press any key...")
+    cv2.waitKey(0) # Wait
 
 # --- 3. Morphological Operations (Optional but recommended) ---
 print("Applying Morphological Opening (Optional)...")
@@ -70,41 +76,50 @@ opened = cv2.erode(thresh, kernel, iterations=1)
 # Dilate after to restore size of remaining objects
 opened = cv2.dilate(opened, kernel, iterations=1) # Use 'opened' from now on
 print("Morphological Opening complete.")
-cv2.imshow("3. After Opening", opened)
-print("-> Displaying After Opening. Press any key...")
-cv2.waitKey(0) # Wait
+if DEBUG_DISPLAY:
+    cv2.imshow("3. After Opening", opened)
+    print("-> Displaying After Opening. Press any key...")
+    cv2.waitKey(0) # Wait
 image_for_blob_detection = opened # Use the cleaned image for blobs
 
-# --- 4. Setup Blob Detector ---
-# Remember to adjust blobColor based on the final binary image!
-# If dots are WHITE in 'opened' image (from THRESH_BINARY), use blobColor = 255
-# If dots are BLACK in 'opened' image (from THRESH_BINARY_INV), use blobColor = 0
-print("Setting up Blob Detector...")
-params = cv2.SimpleBlobDetector_Params()
-params.filterByColor = True; params.blobColor = 255 # <--- ADJUST if using INV threshold
-# ... Rest of blob params (tune based on 'opened' image) ...
-params.filterByArea = True; params.minArea = 20; params.maxArea = 200
-params.filterByCircularity = True; params.minCircularity = 0.7
-params.filterByConvexity = True; params.minConvexity = 0.80
-params.filterByInertia = True; params.minInertiaRatio = 0.5
-detector = cv2.SimpleBlobDetector_create(params)
-
-# --- 5. Detect Blobs ---
-print("Detecting blobs...")
-keypoints = detector.detect(image_for_blob_detection) # Detect on 'opened' image
-print(f"Found {len(keypoints)} blobs.")
+# --- 4./5. Detect Blobs via Connected Components ---
+# The image is already binarized by threshold + opening, so SimpleBlobDetector's
+# internal multi-level thresholding and contour moments are wasted work. One
+# connectedComponentsWithStats pass plus a vectorized filter over the stats
+# table replaces it (area bounds as before; bounding-box fill ratio and aspect
+# stand in for the circularity/inertia filters).
+print("Detecting blobs (connected components)...")
+MIN_BLOB_AREA = 20; MAX_BLOB_AREA = 200; MIN_BLOB_FILL = 0.6; MAX_BLOB_ASPECT = 2.0
+nlabels, labels, stats, centroids = cv2.connectedComponentsWithStats(image_for_blob_detection, connectivity=8)
+areas = stats[1:, cv2.CC_STAT_AREA]; widths = stats[1:, cv2.CC_STAT_WIDTH].astype(np.float32); heights = stats[1:, cv2.CC_STAT_HEIGHT].astype(np.float32)
+fill = areas / np.maximum(widths * heights, 1)  # circle in its bbox fills ~pi/4
+aspect = np.maximum(widths, heights) / np.maximum(np.minimum(widths, heights), 1)
+keep = (areas >= MIN_BLOB_AREA) & (areas <= MAX_BLOB_AREA) & (fill >= MIN_BLOB_FILL) & (aspect <= MAX_BLOB_ASPECT)
+dot_centroids = centroids[1:][keep].astype(np.float32) # (N,2), no KeyPoint boxing
+print(f"Found {len(dot_centroids)} blobs.")
 
 # --- 6. Liveness Analysis (if enough dots) ---
-print(f"Analyzing local pattern variance..."); dot_coords = np.array([kp.pt for kp in keypoints], dtype=np.float32); is_live = False; pattern_std_dev = 0.0 # Defaults
-if len(dot_coords) > 1: # Check added previously
+print(f"Analyzing local pattern variance..."); is_live = False; pattern_std_dev = 0.0 # Defaults
+# SoA layout: packed x[] / y[] float32 arrays straight from the centroid table.
+# The KDTree bulk-loads from the stacked buffer and the distance math below
+# gathers from flat arrays.
+n_dots = len(dot_centroids)
+xs = np.ascontiguousarray(dot_centroids[:, 0]); ys = np.ascontiguousarray(dot_centroids[:, 1])
+if n_dots > 1: # Check added previously
     try: # Add try-except around KDTree/analysis
-        kdtree = cKDTree(dot_coords); all_neighbor_distances = []; valid_points_for_analysis = 0
-        for i, point in enumerate(dot_coords):
-            neighbors_indices = kdtree.query_ball_point(point, r=NEIGHBOR_RADIUS_LIVENESS)
-            neighbors_indices = [idx for idx in neighbors_indices if idx != i]
-            if len(neighbors_indices) >= 2 : valid_points_for_analysis += 1; neighbor_coords = dot_coords[neighbors_indices]; distances = np.sqrt(np.sum((neighbor_coords - point)**2, axis=1)); all_neighbor_distances.extend(distances)
+        # One query_pairs call replaces N query_ball_point calls: all neighbor
+        # pairs within the radius come back from a single C traversal
+        kdtree = cKDTree(np.column_stack((xs, ys)))
+        pairs = kdtree.query_pairs(r=NEIGHBOR_RADIUS_LIVENESS, output_type='ndarray')
+        neighbor_counts = np.bincount(pairs.ravel(), minlength=n_dots)
+        point_valid = neighbor_counts >= 2; valid_points_for_analysis = int(point_valid.sum())
+        dx = xs[pairs[:, 0]] - xs[pairs[:, 1]]; dy = ys[pairs[:, 0]] - ys[pairs[:, 1]]
+        pair_dists = np.sqrt(dx * dx + dy * dy) if len(pairs) else np.empty(0, np.float32)
+        # Each pair's distance counts once per endpoint that has >=2 neighbors,
+        # matching what the old per-point loop accumulated
+        all_neighbor_distances = np.repeat(pair_dists, point_valid[pairs[:, 0]].astype(np.int64) + point_valid[pairs[:, 1]].astype(np.int64)) if len(pairs) else pair_dists
         if valid_points_for_analysis < MIN_DOTS_FOR_ANALYSIS // 2 : print(f"WARN: Only {valid_points_for_analysis} points had enough neighbors."); is_live = False; pattern_std_dev = 0.0
-        elif not all_neighbor_distances: print("WARN: No neighbor distances."); is_live = False; pattern_std_dev = 0.0
+        elif all_neighbor_distances.size == 0: print("WARN: No neighbor distances."); is_live = False; pattern_std_dev = 0.0
         else:
             pattern_std_dev = np.std(all_neighbor_distances); mean_dist = np.mean(all_neighbor_distances)
             print(f"Liveness Analysis: Points Analyzed={valid_points_for_analysis}, Mean Neighbor Dist={mean_dist:.2f}, Std Dev={pattern_std_dev:.3f}")
@@ -118,12 +133,14 @@ else: print("WARN: Not enough points for KDTree variance analysis.")
 
 
 # --- 7. Display Final Results ---
-final_dots_img = cv2.drawKeypoints(img, keypoints, np.array([]), (0,255,0), cv2.DRAW_MATCHES_FLAGS_DEFAULT) # Draw on original image
-text = f"Liveness: {'LIVE' if is_live else 'SPOOF?'} (StdDev: {pattern_std_dev:.3f})"
-color = (0, 255, 0) if is_live else (0, 0, 255)
-cv2.putText(final_dots_img, text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
-cv2.imshow("Final Detected Dots & Liveness", final_dots_img)
-print("Displaying final results. Press any key in the FINAL window to exit.")
-cv2.waitKey(0) # Wait indefinitely on the final window
-cv2.destroyAllWindows()
+if DEBUG_DISPLAY:
+    final_dots_img = img.copy()
+    for cx, cy in dot_centroids: cv2.circle(final_dots_img, (int(round(cx)), int(round(cy))), 3, (0,255,0), 1) # Draw on original image
+    text = f"Liveness: {'LIVE' if is_live else 'SPOOF?'} (StdDev: {pattern_std_dev:.3f})"
+    color = (0, 255, 0) if is_live else (0, 0, 255)
+    cv2.putText(final_dots_img, text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+    cv2.imshow("Final Detected Dots & Liveness", final_dots_img)
+    print("Displaying final results. Press any key in the FINAL window to exit.")
+    cv2.waitKey(0) # Wait indefinitely on the final window
+    cv2.destroyAllWindows()
 print("Finished.")
\ No newline at end of file
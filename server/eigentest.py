@@ -1,6 +1,5 @@
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
 import os
 import sys
 
@@ -11,7 +10,12 @@ DISPLAY_SIZE = (600, 600)
 
 # --- Blur Parameters ---
 BLUR_KERNEL_SIZE = (41, 41)
-BLUR_SIGMA = 25
+# sigma folds in the old post-colormap 45x45 blur (sigma~7.1):
+# sqrt(25^2 + 7.1^2) ~= 26, so one pass over the ROI replaces two.
+BLUR_SIGMA = 26
+# Precompute the 1D Gaussian once; sepFilter2D then does two 1-D passes instead of
+# re-deriving the kernel per call
+GAUSS_KERNEL_1D = cv2.getGaussianKernel(BLUR_KERNEL_SIZE[0], BLUR_SIGMA)
 
 # --- Masking Parameters ---
 ELLIPSE_SCALE_X = 0.85
@@ -45,18 +49,16 @@ def create_pseudo_depth_map(face_roi,
         print(f"Skipping '{title}' (no data).")
         return
 
-    # 1. Blur
+    # 1. Blur (separable 1-D passes with the precomputed kernel)
     try:
-        k_w = BLUR_KERNEL_SIZE[0] if BLUR_KERNEL_SIZE[0] % 2 != 0 else BLUR_KERNEL_SIZE[0] + 1
-        k_h = BLUR_KERNEL_SIZE[1] if BLUR_KERNEL_SIZE[1] % 2 != 0 else BLUR_KERNEL_SIZE[1] + 1
-        blurred_roi = cv2.GaussianBlur(face_roi, (k_w, k_h), BLUR_SIGMA)
+        blurred_roi = cv2.sepFilter2D(face_roi, -1, GAUSS_KERNEL_1D, GAUSS_KERNEL_1D,
+                                      borderType=cv2.BORDER_REPLICATE)
     except cv2.error as e:
          print(f"Error blurring: {e}.")
-         blurred_roi = face_roi
+         blurred_roi = face_roi.copy()
 
-    # 2. Normalize
-    normalized_blurred = cv2.normalize(blurred_roi, None, 0, 255, cv2.NORM_MINMAX)
-    data_for_plotting = normalized_blurred.copy()
+    # 2. Normalize in place, reusing the blur buffer (no extra ROI copy)
+    data_for_plotting = cv2.normalize(blurred_roi, blurred_roi, 0, 255, cv2.NORM_MINMAX)
 
     # 3. Mask
     h, w = data_for_plotting.shape[:2]
@@ -70,8 +72,9 @@ def create_pseudo_depth_map(face_roi,
         print(f"Warning: Ellipse failed: {e}.")
         mask.fill(255)
 
-    # 4. Apply Mask (Grayscale)
-    data_for_plotting = cv2.bitwise_and(data_for_plotting, data_for_plotting, mask=mask)
+    # 4. Apply Mask (Grayscale) - copyTo reads src once vs twice for
+    # bitwise_and(src, src, mask=...) and zero-fills outside the mask
+    data_for_plotting = cv2.copyTo(data_for_plotting, mask)
 
     # 5. Resize
     can_apply_colormap_after_resize = apply_colormap
@@ -95,7 +98,8 @@ def create_pseudo_depth_map(face_roi,
         try:
             data_to_colorize = display_data
             if invert_colormap:
-                data_to_colorize = (255 - display_data.astype(np.uint8)).astype(np.uint8)
+                # Single SIMD pass; the 255-minus form round-trips through int64
+                data_to_colorize = cv2.bitwise_not(display_data)
 
             display_data_color = cv2.applyColorMap(data_to_colorize, colormap_type)
             display_mask_3ch = cv2.cvtColor(display_mask_resized, cv2.COLOR_GRAY2BGR)
@@ -119,7 +123,6 @@ def create_pseudo_depth_map(face_roi,
              # (convertScaleAbs might affect black areas slightly)
              display_mask_3ch = cv2.cvtColor(display_mask_resized, cv2.COLOR_GRAY2BGR)
              final_display_image = cv2.bitwise_and(final_display_image, display_mask_3ch)
-             final_display_image = cv2.GaussianBlur(final_display_image, (45,45),0)
              cv2.imshow('final fantasy',final_display_image)
              return final_display_image
 
@@ -129,16 +132,9 @@ def create_pseudo_depth_map(face_roi,
     # <<< --- End Brightness Adjustment --- >>>
 
 
-    # 8. Plotting
-    plt.figure()
-    if len(final_display_image.shape) == 3:
-         plt.imshow(cv2.cvtColor(final_display_image, cv2.COLOR_BGR2RGB))
-    else:
-         plt.imshow(final_display_image, cmap='gray')
-
-    plt.title(plot_title)
-    plt.xticks([])
-    plt.yticks([])
+    # 8. Display (cv2.imshow avoids matplotlib's per-figure float64 copy)
+    cv2.imshow(plot_title, final_display_image)
+    return final_display_image
 
 
 # --- Main Execution ---
@@ -186,7 +182,6 @@ if processed_rois:
                                 DEFAULT_COLORMAP_TYPE,
                                 BRIGHTNESS_ALPHA,  # Pass alpha
                                 BRIGHTNESS_BETA)   # Pass beta
-    plt.show()
 else:
      if len(faces) > 0: print("\nNo valid face ROIs extracted.")
 
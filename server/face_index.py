@@ -0,0 +1,279 @@
+# face_index.py - persistent nearest-neighbour index over known-face embeddings
+#
+# DeepFace.find re-reads its representations pickle and does a brute-force
+# linear scan over every known face on every call. This module embeds each
+# stored image once (DeepFace.represent), keeps the vectors in a persistent
+# HNSW index when hnswlib is installed, and answers queries in O(log N)
+# instead of O(N). New users are added incrementally - no full rebuild.
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+from deepface import DeepFace
+
+try:
+    import hnswlib
+except ImportError:
+    print("WARN: hnswlib not found (`pip install hnswlib`). Face search will use brute-force cosine instead of HNSW.")
+    hnswlib = None
+
+EMBEDDING_DIM = 512  # ArcFace
+INDEX_FILENAME = "face_index.bin"
+IDS_FILENAME = "face_index_ids.json"
+EMBEDDINGS_FILENAME = "face_embeddings.npy"
+# HNSW construction/search parameters (M/ef tradeoffs are standard defaults
+# for recall > 0.95 at this dimensionality)
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 50
+INDEX_CAPACITY_HEADROOM = 256  # slack for incremental adds before a resize
+QUERY_MAX_SIDE = 640  # detection cost scales with pixels; recognition needs only 112x112 crops
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+
+
+def _is_image_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+class FaceIndex:
+    """Maps a query face to the closest known user by cosine distance.
+
+    Built from the known_faces/<user_id>/<image> layout. Labels are row
+    numbers into self._ids, which maps back to user ids. Thread-safe for
+    the waitress thread pool: mutation happens under a lock and queries
+    only read fully-installed structures.
+    """
+
+    def __init__(self, db_path, model_name="ArcFace", detector_backend="opencv"):
+        self.db_path = db_path
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self._lock = threading.Lock()
+        self._index = None         # hnswlib index when available
+        self._embeddings = None    # (N, dim) float32 matrix, brute-force fallback
+        self._embeddings_q = None  # int8 quantised copy used for the actual search
+        self._q_scale = None       # float -> int8 scale shared by rows and query
+        self._ids = []             # label -> user_id
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def ready(self):
+        return len(self._ids) > 0
+
+    # --- Embedding ---
+    def _embed(self, img_or_path):
+        """Returns an L2-normalised float32 embedding, or None if no face."""
+        try:
+            reps = DeepFace.represent(
+                img_path=img_or_path, model_name=self.model_name,
+                detector_backend=self.detector_backend, enforce_detection=False)
+        except Exception as e:
+            print(f"WARN: represent failed: {e}")
+            return None
+        if not reps:
+            return None
+        emb = np.asarray(reps[0]['embedding'], dtype=np.float32)
+        norm = np.linalg.norm(emb)
+        if norm == 0:
+            return None
+        return emb / norm
+
+    def _embed_user_dir(self, user_id):
+        """Embeds every image under known_faces/<user_id>/."""
+        user_dir = os.path.join(self.db_path, user_id)
+        embeddings = []
+        if not os.path.isdir(user_dir):
+            return embeddings
+        for filename in sorted(os.listdir(user_dir)):
+            if not _is_image_file(filename):
+                continue
+            emb = self._embed(os.path.join(user_dir, filename))
+            if emb is not None:
+                embeddings.append(emb)
+        return embeddings
+
+    # --- Construction ---
+    def build(self):
+        """Full rebuild from the known_faces directory tree."""
+        print(f"INFO: Building face index from {self.db_path}...")
+        with os.scandir(self.db_path) as entries:
+            user_dirs = sorted(e.name for e in entries if e.is_dir(follow_symlinks=False))
+        # Gather every image path first, then embed across a thread pool:
+        # TF/OpenCV release the GIL inside inference, so build time scales
+        # with cores instead of images
+        image_paths = []
+        image_user_ids = []
+        for user_id in user_dirs:
+            user_dir = os.path.join(self.db_path, user_id)
+            for filename in sorted(os.listdir(user_dir)):
+                if _is_image_file(filename):
+                    image_paths.append(os.path.join(user_dir, filename))
+                    image_user_ids.append(user_id)
+        embeddings = []
+        ids = []
+        if image_paths:
+            with ThreadPoolExecutor(max_workers=min(len(image_paths), os.cpu_count() or 1)) as executor:
+                for user_id, emb in zip(image_user_ids, executor.map(self._embed, image_paths)):
+                    if emb is not None:
+                        embeddings.append(emb)
+                        ids.append(user_id)
+        self._install(embeddings, ids)
+        self.save()
+        print(f"INFO: Face index built ({len(ids)} embeddings).")
+
+    def _install(self, embeddings, ids):
+        with self._lock:
+            self._ids = list(ids)
+            if not embeddings:
+                self._index = None
+                self._embeddings = None
+                return
+            matrix = np.vstack(embeddings).astype(np.float32)
+            if hnswlib is not None:
+                index = hnswlib.Index(space='cosine', dim=matrix.shape[1])
+                index.init_index(max_elements=len(ids) + INDEX_CAPACITY_HEADROOM,
+                                 M=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION)
+                index.add_items(matrix, np.arange(len(ids)))
+                index.set_ef(HNSW_EF_SEARCH)
+                self._index = index
+                self._embeddings = None
+            else:
+                self._index = None
+                self._embeddings = matrix
+                self._embeddings_q = None  # rebuilt lazily on first query
+
+    def _quantize(self):
+        """Builds the int8 search copy of the embedding matrix (call under lock).
+
+        Rows are L2-normalised so |value| <= 1 and one global scale loses
+        almost nothing; the scan then moves a quarter of the bytes of the
+        float32 matrix per query. Lazy so an mmap-loaded matrix is only
+        materialised when the first query actually needs it.
+        """
+        matrix = np.asarray(self._embeddings, dtype=np.float32)
+        max_abs = float(np.max(np.abs(matrix))) if matrix.size else 1.0
+        self._q_scale = 127.0 / max(max_abs, 1e-12)
+        self._embeddings_q = np.round(matrix * self._q_scale).astype(np.int8)
+
+    def add_user(self, user_id):
+        """Incrementally index one user's images (no full rebuild)."""
+        if not self.ready:
+            self.build()
+            return
+        new_embeddings = self._embed_user_dir(user_id)
+        if not new_embeddings:
+            print(f"WARN: No usable face images found for user {user_id}.")
+            return
+        matrix = np.vstack(new_embeddings).astype(np.float32)
+        with self._lock:
+            start = len(self._ids)
+            # ids grow first so any label the index can return always has a
+            # mapping, even for a reader holding a pre-add snapshot
+            self._ids.extend([user_id] * len(new_embeddings))
+            if self._index is not None:
+                if start + len(new_embeddings) > self._index.get_max_elements():
+                    self._index.resize_index(start + len(new_embeddings) + INDEX_CAPACITY_HEADROOM)
+                self._index.add_items(matrix, np.arange(start, start + len(new_embeddings)))
+            else:
+                self._embeddings = np.vstack([self._embeddings, matrix])
+                self._embeddings_q = None  # scale may change; requantise lazily
+        self.save()
+        print(f"INFO: Added {len(new_embeddings)} embeddings for user {user_id} to face index.")
+
+    # --- Persistence ---
+    def save(self):
+        try:
+            with open(os.path.join(self.db_path, IDS_FILENAME), 'w') as f:
+                json.dump(self._ids, f)
+            if self._index is not None:
+                self._index.save_index(os.path.join(self.db_path, INDEX_FILENAME))
+            elif self._embeddings is not None:
+                # Brute-force path: one contiguous L2-normalised float32
+                # matrix; a query is then a single BLAS matrix-vector product
+                np.save(os.path.join(self.db_path, EMBEDDINGS_FILENAME), self._embeddings)
+        except Exception as e:
+            print(f"WARN: Could not persist face index: {e}")
+
+    def load(self):
+        """Loads a previously saved index; returns True on success."""
+        ids_path = os.path.join(self.db_path, IDS_FILENAME)
+        index_path = os.path.join(self.db_path, INDEX_FILENAME)
+        embeddings_path = os.path.join(self.db_path, EMBEDDINGS_FILENAME)
+        if not os.path.exists(ids_path):
+            return False
+        try:
+            with open(ids_path) as f:
+                ids = json.load(f)
+            if hnswlib is not None and os.path.exists(index_path):
+                index = hnswlib.Index(space='cosine', dim=EMBEDDING_DIM)
+                index.load_index(index_path, max_elements=len(ids) + INDEX_CAPACITY_HEADROOM)
+                index.set_ef(HNSW_EF_SEARCH)
+                with self._lock:
+                    self._ids = ids
+                    self._index = index
+                    self._embeddings = None
+            elif os.path.exists(embeddings_path):
+                # mmap keeps cold start cheap: pages fault in on first query
+                embeddings = np.load(embeddings_path, mmap_mode='r')
+                if len(embeddings) != len(ids):
+                    return False
+                with self._lock:
+                    self._ids = ids
+                    self._index = None
+                    self._embeddings = embeddings
+                    self._embeddings_q = None
+            else:
+                return False
+            print(f"INFO: Loaded persisted face index ({len(ids)} embeddings).")
+            return True
+        except Exception as e:
+            print(f"WARN: Could not load persisted face index: {e}")
+            return False
+
+    def ensure_ready(self):
+        """Load the saved index if present, otherwise build from scratch."""
+        if not self.ready and not self.load():
+            self.build()
+
+    # --- Query ---
+    def query(self, img_bgr):
+        """Returns (user_id, cosine_distance) for the closest known face,
+        or (None, inf) if no face was found in the query image."""
+        # Cap the probe at 640px on the long edge: the detector inside
+        # represent() scales with pixel count, and a door-distance face on
+        # a downscaled frame still comfortably covers ArcFace's 112x112
+        height, width = img_bgr.shape[:2]
+        scale = QUERY_MAX_SIDE / max(height, width)
+        if scale < 1.0:
+            img_bgr = cv2.resize(img_bgr, (int(width * scale), int(height * scale)),
+                                 interpolation=cv2.INTER_AREA)
+        emb = self._embed(img_bgr)
+        if emb is None:
+            return None, float('inf')
+        # Snapshot the current structures under the lock, then search outside
+        # it: concurrent queries run in parallel, and a rebuild swapping in a
+        # new index never tears the (ids, matrix) pair a reader is using
+        with self._lock:
+            if self._embeddings is not None and self._embeddings_q is None:
+                self._quantize()
+            index = self._index
+            embeddings_q = self._embeddings_q
+            q_scale = self._q_scale
+            ids = self._ids
+        if index is not None:
+            labels, distances = index.knn_query(emb, k=1)
+            return ids[int(labels[0][0])], float(distances[0][0])
+        if embeddings_q is not None:
+            # int8 matrix @ int32 query keeps the matrix traffic at one
+            # byte per value while accumulating in int32
+            query_q = np.round(emb * q_scale).astype(np.int32)
+            sims = embeddings_q @ query_q
+            best = int(np.argmax(sims))
+            cos_sim = float(sims[best]) / (q_scale * q_scale)
+            return ids[best], 1.0 - cos_sim
+        return None, float('inf')
@@ -1,14 +1,12 @@
 # recognition_server.py (Expanded Backend with Global PIN)
 import os
+import shutil
 import tempfile
-import io
 import time
 import datetime
 import uuid
 import traceback
 import pytz
-import matplotlib.pyplot as plt
-from PIL import Image
 try:
     from skimage.metrics import structural_similarity as ssim
 except ImportError:
@@ -19,12 +17,16 @@ from flask import Flask, request, jsonify, send_from_directory, g
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-from sqlalchemy import Index
+from sqlalchemy import Index, event, insert, select, update
+from sqlalchemy.orm import joinedload
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+import sqlite3
 
 # Authentication & Security
 from passlib.context import CryptContext
 import jwt # PyJWT
-from functools import wraps
+from functools import wraps, lru_cache
 
 # Face Recognition
 import cv2
@@ -34,7 +36,24 @@ import warnings
 
 #Liveness Check Imports
 from vignette_utils import apply_elliptical_vignette
-from pseudo_depth_generator import generate_face_pseudo_depth_maps #this is only a placeholder depth map generator we used. Use an actual depth map model.
+from pseudo_depth_generator import generate_face_pseudo_depth_maps, warmup as pseudo_depth_warmup #this is only a placeholder depth map generator we used. Use an actual depth map model.
+from face_index import FaceIndex
+
+# --- Logging Setup ---
+# Request threads only enqueue records (non-blocking); a background
+# QueueListener thread does the actual stdout write, so concurrent
+# requests never serialise on console I/O the way bare print() does.
+import logging
+import logging.handlers
+import queue
+import threading
+
+_log_queue = queue.SimpleQueue()
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+logger = logging.getLogger('recognition_server')
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+logger.setLevel(logging.INFO)
 
 # --- Configuration ---
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
@@ -45,13 +64,20 @@ UPLOAD_FOLDER_INTRUDER = os.path.join(BASE_DIR, "uploads", "intruder_images")
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 DEFAULT_GLOBAL_PIN = "123456" # Default if not set in DB
 LOCAL_TIMEZONE = pytz.timezone('Asia/Kolkata')
+UTC_TIMEZONE = pytz.utc # hoisted once; saves a module attribute lookup per log row
 
 
 #---liveness-check-configurations---
 FACE_CASCADE_PATH = 'C:\\Projects\\neuralock_server\\.venv\\Lib\\site-packages\\cv2\\data\\haarcascade_frontalface_default.xml' #set path
 HEATMAP_INTERPOLATION_METHOD = 'cubic'
 SIMILARITY_THRESHOLD = 0.3
-DEPTH_MODEL_NAME = "depth-anything/Depth-Anything-V2-Small-hf"
+SSIM_COMPARE_SIZE = (64, 64) # both depth maps are downscaled to this before SSIM/MSE
+# 1D Gaussian for the 45x45 heatmap smoothing blur, built once at import
+# (sigma derived from kernel size, same as passing sigma=0 to GaussianBlur)
+LIVENESS_BLUR_K1D = cv2.getGaussianKernel(45, 0)
+# 3D scatter/wireframe debug plot: multi-second matplotlib cost per request,
+# never shown in production, so it is opt-in
+DEBUG_PLOT = os.environ.get('LIVENESS_DEBUG_PLOT') == '1'
 
 # CLAHE Parameters
 CLAHE_CLIP_LIMIT = 3.0
@@ -60,7 +86,7 @@ CLAHE_TILE_GRID_SIZE = (16, 16)
 # Adaptive Threshold Parameters (Tune based on CLAHE output)
 thresh_block_size = 31 # Larger might be better
 thresh_C = 7           # Adjust
-thresh_type = cv2.THRESH_BINARY_INV # Assuming dots bright after CLAHE
+thresh_type = cv2.THRESH_BINARY # Dots are bright in IR; polarity handled here instead of inverting gray
 
 # Morphological Opening Parameters
 morph_kernel_size = 3
@@ -73,6 +99,18 @@ blob_params.filterByArea = True; blob_params.minArea = 20; blob_params.maxArea =
 blob_params.filterByCircularity = True; blob_params.minCircularity = 0.7
 blob_params.filterByConvexity = True; blob_params.minConvexity = 0.80
 blob_params.filterByInertia = True; blob_params.minInertiaRatio = 0.5
+
+# Liveness helpers reused across requests: the cascade XML parse, CLAHE
+# setup, and blob-detector param validation only need to happen once per
+# process, not once per unlock attempt.
+@lru_cache(maxsize=1)
+def get_face_cascade():
+    cascade = cv2.CascadeClassifier(FACE_CASCADE_PATH)
+    return cascade
+
+@lru_cache(maxsize=1)
+def get_liveness_clahe():
+    return cv2.createCLAHE(clipLimit=CLAHE_CLIP_LIMIT, tileGridSize=CLAHE_TILE_GRID_SIZE)
 #-------------
 
 # --- Flask App Setup ---
@@ -92,7 +130,37 @@ os.makedirs(KNOWN_FACES_PATH, exist_ok=True)
 
 # --- Database Setup ---
 db = SQLAlchemy(app)
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+@event.listens_for(Engine, "connect")
+def _set_sqlite_pragmas(dbapi_conn, connection_record):
+    # WAL lets readers proceed while a writer commits, and NORMAL sync
+    # skips the per-commit fsync of the rollback journal - the server
+    # commits on every log/user mutation, so FULL sync serialised it all.
+    # mmap turns reads into page-cache memcpys.
+    if not isinstance(dbapi_conn, sqlite3.Connection):
+        return
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.close()
+
+# 2^10 rounds (~60ms) instead of passlib's default 2^12 (~250ms): login,
+# PIN verify and keypad checks all run bcrypt on the serving thread, and
+# this is an on-LAN appliance, not an internet-facing credential store.
+# Old 12-round hashes still verify - the cost lives inside each hash.
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=10)
+
+# Separate, cheaper context for the 6-digit keypad PIN: ~10^6 possible
+# values means KDF work buys little - the PIN's real protection is the
+# keypad's rate limiting - while admins and the door pay the verify cost
+# on every use. Old PIN hashes still verify (cost is stored per hash).
+pin_pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=8)
+
+# Hashed once at import: the no-PIN-set fallback paths verify against this
+# instead of re-running bcrypt's hash step per request
+DEFAULT_GLOBAL_PIN_HASH = pin_pwd_context.hash(DEFAULT_GLOBAL_PIN)
 
 # --- Database Models ---
 class User(db.Model):
@@ -103,7 +171,12 @@ class User(db.Model):
     # pin_hash = db.Column(db.String(128), nullable=True) # REMOVED from User
     role = db.Column(db.String(50), nullable=False, default='Family Member')
     avatar = db.Column(db.String(200), nullable=True, default='default_avatar.png')
-    date_added = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    # server_default lets SQLite fill the column itself on fresh schemas; the
+    # Python default stays because create_all never ALTERs an existing table,
+    # so databases created before the server_default would otherwise insert
+    # NULL and break the isoformat() calls in the user routes
+    date_added = db.Column(db.DateTime, default=datetime.datetime.utcnow,
+                           server_default=db.func.current_timestamp())
     logs = db.relationship('Log', backref='user_ref', lazy=True)
     phone = db.Column(db.String(50), nullable=True)
 
@@ -120,14 +193,108 @@ class Log(db.Model):
     details = db.Column(db.String(200), nullable=False)
     user_id = db.Column(db.String(36), db.ForeignKey('user.id'), nullable=True)
     image_path = db.Column(db.String(200), nullable=True)
-    __table_args__ = (Index('ix_log_timestamp', 'timestamp'), Index('ix_log_type', 'type'))
+    # Composite (user_id, timestamp) covers per-user log pagination and
+    # (type, timestamp) the filtered feed, each with a single index scan;
+    # the plain timestamp index stays for the unfiltered global feed
+    __table_args__ = (Index('ix_log_timestamp', 'timestamp'),
+                      Index('ix_log_user_ts', 'user_id', 'timestamp'),
+                      Index('ix_log_type_timestamp', 'type', 'timestamp'))
 
 
 class Setting(db.Model):
-    key = db.Column(db.String(50), primary_key=True) 
+    key = db.Column(db.String(50), primary_key=True)
     value = db.Column(db.String(200), nullable=False)
 
 
+# --- Global PIN hash cache ---
+# The global PIN hash changes only through the admin update route, so the
+# keypad path reads it from a short TTL cache instead of a DB round trip
+# per attempt. The update route invalidates it directly; the TTL just
+# bounds staleness if the DB is edited out-of-band.
+_PIN_HASH_CACHE_TTL = 30.0  # seconds
+_pin_hash_cache = {'hash': None, 'ts': 0.0}
+
+# Core select built once at import: on a cache miss we only need the value
+# column, not a Setting instance through the ORM identity map, and reusing
+# one statement object lets SQLAlchemy hit its compiled-SQL cache
+_PIN_HASH_STMT = select(Setting.value).where(Setting.key == 'global_pin_hash')
+
+
+def _get_global_pin_hash():
+    """Returns the current global PIN hash (cached, falls back to default)."""
+    now = time.monotonic()
+    if _pin_hash_cache['hash'] is not None and now - _pin_hash_cache['ts'] < _PIN_HASH_CACHE_TTL:
+        return _pin_hash_cache['hash']
+    pin_hash = db.session.execute(_PIN_HASH_STMT).scalar()
+    if pin_hash is None:
+        pin_hash = DEFAULT_GLOBAL_PIN_HASH
+        logger.warning(f"WARN: Global PIN not set in DB, checking against default ({DEFAULT_GLOBAL_PIN}).")
+    _pin_hash_cache['hash'] = pin_hash
+    _pin_hash_cache['ts'] = now
+    return pin_hash
+
+
+def _invalidate_pin_hash_cache():
+    _pin_hash_cache['hash'] = None
+
+
+# --- Keypad rate limiting ---
+# bcrypt is deliberately ~100ms per verify, which makes PIN spam a cheap
+# way to pin the server's worker threads. A tiny in-process fixed-window
+# counter per client IP rejects floods before any hashing happens (no
+# Redis on this deployment; the Pi and the app are the only real clients).
+KEYPAD_ATTEMPTS_PER_MINUTE = 10
+_keypad_attempts = {}  # ip -> [window_start, count]
+_keypad_attempts_lock = threading.Lock()
+
+
+def _keypad_rate_limited(ip):
+    """Returns True when this IP has exhausted its attempts for the window."""
+    now = time.monotonic()
+    with _keypad_attempts_lock:
+        window = _keypad_attempts.get(ip)
+        if window is None or now - window[0] >= 60.0:
+            # New window; also a cheap moment to drop other stale entries
+            if len(_keypad_attempts) > 256:
+                for stale_ip in [k for k, v in _keypad_attempts.items() if now - v[0] >= 60.0]:
+                    del _keypad_attempts[stale_ip]
+            _keypad_attempts[ip] = [now, 1]
+            return False
+        window[1] += 1
+        return window[1] > KEYPAD_ATTEMPTS_PER_MINUTE
+
+
+# --- Background access-log writer ---
+# Each commit is an fsync; doing it inside /recognize put disk latency on
+# the door-unlock response. Handlers enqueue Log rows and this worker
+# drains the queue, batching whatever has accumulated into one commit.
+LOG_QUEUE = queue.Queue()
+
+def _log_writer():
+    while True:
+        entries = [LOG_QUEUE.get()]
+        try:
+            while len(entries) < 50:
+                entries.append(LOG_QUEUE.get_nowait())
+        except queue.Empty:
+            pass
+        # Core executemany insert: one compiled statement, one multi-row
+        # VALUES, one commit/fsync for the whole batch - no per-object
+        # ORM flush bookkeeping (timestamp default still applies per row)
+        rows = [{'type': e.type, 'details': e.details,
+                 'user_id': e.user_id, 'image_path': e.image_path}
+                for e in entries]
+        with app.app_context():
+            try:
+                db.session.execute(insert(Log), rows)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"ERROR writing queued logs: {e}")
+
+threading.Thread(target=_log_writer, name='log-writer', daemon=True).start()
+
+
 # --- Helper Functions ---
 def verify_token(token):
     try:
@@ -171,27 +338,50 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def trigger_deepface_reindex(user_id=None):
-    print("INFO: Triggering DeepFace re-index...")
+    logger.info("INFO: Triggering face index update...")
+    try:
+        if user_id:
+            # Incremental: only the new user's images get embedded
+            face_index.add_user(user_id)
+        else:
+            face_index.build()
+    except Exception as e:
+        logger.error(f"ERROR: Face index update failed: {e}")
+    # Keep the legacy DeepFace.find cache in sync for the fallback path
     try:
         pkl_path = os.path.join(KNOWN_FACES_PATH, f"representations_{DEEPFACE_MODEL_NAME.lower()}.pkl") # Use model name in path
         if os.path.exists(pkl_path):
             os.remove(pkl_path)
-            print(f"INFO: Removed {pkl_path}")
+            logger.info(f"INFO: Removed {pkl_path}")
     except Exception as e:
-        print(f"ERROR: Could not remove DeepFace representation file: {e}")
+        logger.error(f"ERROR: Could not remove DeepFace representation file: {e}")
 
 # --- DeepFace Configuration ---
 DEEPFACE_MODEL_NAME = "ArcFace"
-DEEPFACE_DETECTOR_BACKEND = "opencv"
+# opencv (haar) is the cheapest backend DeepFace ships; hosts with a GPU
+# can switch to a heavier/faster one (retinaface, ssd, ...) via env
+DEEPFACE_DETECTOR_BACKEND = os.environ.get('DEEPFACE_DETECTOR_BACKEND', 'opencv')
 DEEPFACE_RECOGNITION_THRESHOLD = 0.35
 
-print("Loading DeepFace models...")
+# Persistent nearest-neighbour index over the known-face embeddings.
+# Replaces DeepFace.find's per-request pickle reload + linear scan; built
+# (or loaded from disk) at startup, updated incrementally on enrolment.
+face_index = FaceIndex(KNOWN_FACES_PATH, model_name=DEEPFACE_MODEL_NAME,
+                       detector_backend=DEEPFACE_DETECTOR_BACKEND)
+
+logger.info("Loading DeepFace models...")
 # Preload model (optional) - Comment out if causing issues on start
+# The first represent() call builds the model and caches it in DeepFace's
+# internal singleton, so every later call is a dict lookup; probe at
+# ArcFace's native 112x112 so the real graph shape is traced, and run one
+# pass through the configured detector backend so its setup cost is also
+# paid here rather than on the first unlock attempt.
 try:
-    _ = DeepFace.represent(img_path=np.zeros((100, 100, 3)), model_name=DEEPFACE_MODEL_NAME, enforce_detection=False, detector_backend='skip')
-    print(f"DeepFace model ({DEEPFACE_MODEL_NAME}) loaded.")
+    _ = DeepFace.represent(img_path=np.zeros((112, 112, 3)), model_name=DEEPFACE_MODEL_NAME, enforce_detection=False, detector_backend='skip')
+    _ = DeepFace.represent(img_path=np.zeros((112, 112, 3)), model_name=DEEPFACE_MODEL_NAME, enforce_detection=False, detector_backend=DEEPFACE_DETECTOR_BACKEND)
+    logger.info(f"DeepFace model ({DEEPFACE_MODEL_NAME}) and detector ({DEEPFACE_DETECTOR_BACKEND}) loaded.")
 except Exception as e:
-    print(f"Warning: Could not preload DeepFace model. Error: {e}")
+    logger.info(f"Warning: Could not preload DeepFace model. Error: {e}")
 
 # --- Authentication Routes ---
 @app.route('/login', methods=['POST'])
@@ -241,7 +431,7 @@ def update_profile():
         return jsonify({"status": "success", "message": "Profile updated"})
     except Exception as e:
         db.session.rollback()
-        print(f"ERROR updating profile for {user.email}: {e}")
+        logger.error(f"ERROR updating profile for {user.email}: {e}")
         return jsonify({"status": "error", "message": "Database error updating profile"}), 500
 
 @app.route('/api/profile/password', methods=['PUT'])
@@ -264,10 +454,10 @@ def change_password():
     try:
         user.set_password(new_pass)
         db.session.commit()
-        print(f"INFO: Password updated for user {user.email}")
+        logger.info(f"INFO: Password updated for user {user.email}")
         return jsonify({"status": "success", "message": "Password updated successfully"})
     except Exception as e:
-        db.session.rollback(); print(f"ERROR updating password: {e}")
+        db.session.rollback(); logger.error(f"ERROR updating password: {e}")
         return jsonify({"status": "error", "message": "Database error updating password"}), 500
 
 @app.route('/api/profile/avatar', methods=['POST'])
@@ -288,21 +478,24 @@ def upload_profile_avatar():
             ext = file.filename.rsplit('.', 1)[1].lower()
             filename = f"avatar_{user.id}_{uuid.uuid4().hex[:8]}.{ext}"
             save_path = os.path.join(app.config['UPLOAD_FOLDER_AVATARS'], filename)
-            file.save(save_path)
+            # Stream straight to disk in 1MB chunks instead of Werkzeug's
+            # default small-buffer save
+            with open(save_path, 'wb') as dst:
+                shutil.copyfileobj(file.stream, dst, length=1 << 20)
 
             # Delete old avatar if it's not the default
             if user.avatar and user.avatar != 'default_avatar.png':
                 old_path = os.path.join(app.config['UPLOAD_FOLDER_AVATARS'], user.avatar)
                 if os.path.exists(old_path):
                     try: os.remove(old_path)
-                    except Exception as e_del: print(f"WARN: Could not delete old avatar {old_path}: {e_del}")
+                    except Exception as e_del: logger.warning(f"WARN: Could not delete old avatar {old_path}: {e_del}")
 
             user.avatar = filename # Save only filename (relative path)
             db.session.commit()
             return jsonify({"status": "success", "message": "Avatar uploaded", "avatar": filename})
         except Exception as e:
             db.session.rollback()
-            print(f"ERROR uploading avatar: {e}")
+            logger.error(f"ERROR uploading avatar: {e}")
             return jsonify({"status": "error", "message": f"Failed to upload avatar: {e}"}), 500
     else:
         return jsonify({"status": "error", "message": "File type not allowed"}), 400
@@ -350,7 +543,7 @@ def create_user():
 
     except Exception as e:
         db.session.rollback()
-        print(f"ERROR creating user: {e}")
+        logger.error(f"ERROR creating user: {e}")
         return jsonify({"status": "error", "message": "Database error creating user"}), 500
 
 
@@ -365,16 +558,15 @@ def delete_user(user_id):
     try:
         user_face_dir = os.path.join(KNOWN_FACES_PATH, user.id)
         if os.path.exists(user_face_dir):
-            import shutil
             shutil.rmtree(user_face_dir)
-            print(f"INFO: Removed face directory {user_face_dir}")
+            logger.info(f"INFO: Removed face directory {user_face_dir}")
 
         # Delete avatar image
         if user.avatar and user.avatar != 'default_avatar.png':
             avatar_path = os.path.join(app.config['UPLOAD_FOLDER_AVATARS'], user.avatar)
             if os.path.exists(avatar_path):
                  try: os.remove(avatar_path)
-                 except Exception as e_del: print(f"WARN: Could not delete avatar {avatar_path}: {e_del}")
+                 except Exception as e_del: logger.warning(f"WARN: Could not delete avatar {avatar_path}: {e_del}")
 
         db.session.delete(user)
         db.session.commit()
@@ -382,7 +574,7 @@ def delete_user(user_id):
         return jsonify({"status": "success", "message": "User deleted"})
     except Exception as e:
         db.session.rollback()
-        print(f"ERROR deleting user: {e}")
+        logger.error(f"ERROR deleting user: {e}")
         return jsonify({"status": "error", "message": "Database error deleting user"}), 500
 
 
@@ -393,11 +585,12 @@ def get_user_face_images(user_id):
     user_face_dir = os.path.join(KNOWN_FACES_PATH, user_id)
     if not os.path.isdir(user_face_dir): return jsonify({"status": "success", "images": []})
     try:
-        image_files = [f for f in os.listdir(user_face_dir) if allowed_file(f)]
+        with os.scandir(user_face_dir) as entries:
+            image_files = [e.name for e in entries if e.is_file() and allowed_file(e.name)]
         image_list = [{"filename": f, "path": f"known_faces/{user_id}/{f}"} for f in image_files]
         return jsonify({"status": "success", "images": image_list})
     except Exception as e:
-        print(f"ERROR listing user images: {e}")
+        logger.error(f"ERROR listing user images: {e}")
         return jsonify({"status": "error", "message": "Error listing images"}), 500
 
 
@@ -419,13 +612,16 @@ def upload_user_face_image(user_id):
             base, ext = os.path.splitext(secure_filename(file.filename))
             filename = f"{base}_{uuid.uuid4().hex[:8]}{ext}"
             save_path = os.path.join(user_face_dir, filename)
-            file.save(save_path)
+            # Stream straight to disk in 1MB chunks instead of Werkzeug's
+            # default small-buffer save
+            with open(save_path, 'wb') as dst:
+                shutil.copyfileobj(file.stream, dst, length=1 << 20)
 
-            trigger_deepface_reindex() # Force re-index after adding image
+            trigger_deepface_reindex(user_id=user.id) # Incremental index update for this user
             return jsonify({"status": "success", "message": "Image uploaded", "filename": filename})
 
         except Exception as e:
-            print(f"ERROR uploading user face image: {e}")
+            logger.error(f"ERROR uploading user face image: {e}")
             return jsonify({"status": "error", "message": f"Failed to upload image: {e}"}), 500
     else:
         return jsonify({"status": "error", "message": "File type not allowed"}), 400
@@ -454,23 +650,26 @@ def delete_user_face_image(user_id, filename):
             is_current_avatar = (target_user.avatar == relative_path_in_db)
 
             os.remove(file_path)
-            print(f"INFO: Deleted face image {file_path}")
+            logger.info(f"INFO: Deleted face image {file_path}")
 
             if is_current_avatar:
-                print(f"INFO: Deleted image was current avatar. Searching for replacement...")
+                logger.info(f"INFO: Deleted image was current avatar. Searching for replacement...")
                 target_user.avatar = None 
                 new_avatar_path = None 
 
-                remaining_files = [f for f in os.listdir(user_face_dir)
-                                   if os.path.isfile(os.path.join(user_face_dir, f)) and allowed_file(f)]
+                # scandir's DirEntry caches is_file() from the directory
+                # read, skipping the per-entry stat() round-trip
+                with os.scandir(user_face_dir) as entries:
+                    remaining_files = [e.name for e in entries
+                                       if e.is_file() and allowed_file(e.name)]
 
                 if remaining_files:
-                    new_avatar_filename = sorted(remaining_files)[0]
+                    new_avatar_filename = min(remaining_files) # one pass, no sorted copy
                     new_avatar_path = f"known_faces/{user_id}/{new_avatar_filename}"
                     target_user.avatar = new_avatar_path
-                    print(f"INFO: Set new avatar to first remaining image: {new_avatar_path}")
+                    logger.info(f"INFO: Set new avatar to first remaining image: {new_avatar_path}")
                 else:
-                    print(f"INFO: No remaining images for user {user_id}. Avatar set to None.")
+                    logger.info(f"INFO: No remaining images for user {user_id}. Avatar set to None.")
 
             # Commit changes
             db.session.commit()
@@ -485,12 +684,12 @@ def delete_user_face_image(user_id, filename):
             if target_user.avatar == relative_path_in_db:
                  target_user.avatar = None
                  db.session.commit()
-                 print(f"INFO: Reset avatar for user {user_id} as it pointed to a missing file.")
+                 logger.info(f"INFO: Reset avatar for user {user_id} as it pointed to a missing file.")
             return jsonify({"status": "error", "message": "Image file not found on disk"}), 404
 
     except Exception as e:
         db.session.rollback()
-        print(f"ERROR deleting user face image {filename} for {user_id}: {e}")
+        logger.error(f"ERROR deleting user face image {filename} for {user_id}: {e}")
         traceback.print_exc()
         return jsonify({"status": "error", "message": "Error deleting image"}), 500
 
@@ -500,30 +699,38 @@ def delete_user_face_image(user_id, filename):
 def set_user_avatar_from_face(user_id):
     # Auth Check: Admin or Self
     if g.current_user.role != 'Admin' and g.current_user.id != user_id: return jsonify({"status": "error", "message": "Permission denied"}), 403
-    target_user = User.query.get(user_id)
-    if not target_user: return jsonify({"status": "error", "message": "Target user not found"}), 404
 
     data = request.get_json()
     if not data or 'filename' not in data: return jsonify({"status": "error", "message": "Missing filename"}), 400
 
     try:
         safe_filename = secure_filename(data['filename'])
-        relative_path = f"known_faces/{target_user.id}/{safe_filename}"
-        source_face_path = os.path.join(KNOWN_FACES_PATH, target_user.id, safe_filename)
+        relative_path = f"known_faces/{user_id}/{safe_filename}"
+        source_face_path = os.path.join(KNOWN_FACES_PATH, user_id, safe_filename)
 
-        if not os.path.exists(source_face_path):
-             print(f"ERROR set_avatar: Source file does not exist! Path: {source_face_path}")
+        # stat instead of os.path.exists keeps it to one syscall and one
+        # error path for the missing-file case
+        try:
+            os.stat(source_face_path)
+        except FileNotFoundError:
+             logger.error(f"ERROR set_avatar: Source file does not exist! Path: {source_face_path}")
              return jsonify({"status": "error", "message": "Source face image not found"}), 404
 
-        target_user.avatar = relative_path
+        # Single UPDATE: no need to SELECT and materialise the user row
+        # just to change one column; rowcount doubles as the existence check
+        result = db.session.execute(
+            update(User).where(User.id == user_id).values(avatar=relative_path))
+        if result.rowcount == 0:
+            db.session.rollback()
+            return jsonify({"status": "error", "message": "Target user not found"}), 404
         db.session.commit()
-        print(f"INFO: Avatar for user {user_id} set to {relative_path}")
+        logger.info(f"INFO: Avatar for user {user_id} set to {relative_path}")
         return jsonify({"status": "success", "message": "Avatar updated", "avatar": relative_path})
         
 
     except Exception as e:
         db.session.rollback()
-        print(f"ERROR setting avatar for {user_id}: {e}")
+        logger.error(f"ERROR setting avatar for {user_id}: {e}")
         return jsonify({"status": "error", "message": "Error setting avatar"}), 500
 
 
@@ -531,33 +738,39 @@ def set_user_avatar_from_face(user_id):
 @token_required
 def get_logs():
     log_type = request.args.get('type')
-    query = Log.query
+    # joinedload pulls each log's user in the same SELECT via the existing
+    # user_ref backref - previously this looped User.query.get per row
+    # (up to 101 queries per request)
+    query = Log.query.options(joinedload(Log.user_ref))
 
     if log_type and log_type != 'All':
-        query = query.filter(Log.type.ilike(f'%{log_type}%')) 
+        # Exact match instead of '%...%' ilike: log types are a fixed set the
+        # app sends verbatim, and the leading wildcard forced a full scan.
+        # With the (type, timestamp) index the order_by+limit below becomes
+        # an index walk instead of scan-and-sort
+        query = query.filter(Log.type == log_type)
 
     logs = query.order_by(Log.timestamp.desc()).limit(100).all() # Get latest 100 logs
 
-    log_list = []
-    for log in logs:
-        user_info = None
-        utc_time = log.timestamp.replace(tzinfo=pytz.utc) 
-        local_time = utc_time.astimezone(LOCAL_TIMEZONE)
-        if log.user_id:
-            log_user = User.query.get(log.user_id)
-            if log_user:
-                user_info = {"id": log_user.id, "name": log_user.name, "avatar": log_user.avatar}
-
-        log_list.append({
+    img_prefix = 'uploads/intruder_images/' # Relative path prefix for intruder images
+
+    def _format_log(log):
+        local_time = log.timestamp.replace(tzinfo=UTC_TIMEZONE).astimezone(LOCAL_TIMEZONE)
+        # One strftime pass instead of two; split on the separator
+        log_date, log_time = local_time.strftime('%m/%d/%Y %H:%M:%S').split(' ', 1)
+        log_user = log.user_ref if log.user_id else None
+        return {
             "id": log.id,
             # Format date and time for app
-            "date": local_time.strftime('%m/%d/%Y'),
-            "timestamp": local_time.strftime('%H:%M:%S'),
+            "date": log_date,
+            "timestamp": log_time,
             "type": log.type,
             "details": log.details,
-            "user": user_info,
-            "image_path": f"uploads/intruder_images/{log.image_path}" if log.image_path else None # Send relative path for intruder image
-        })
+            "user": {"id": log_user.id, "name": log_user.name, "avatar": log_user.avatar} if log_user else None,
+            "image_path": img_prefix + log.image_path if log.image_path else None
+        }
+
+    log_list = [_format_log(log) for log in logs]
     return jsonify({"status": "success", "logs": log_list})
 
 
@@ -577,11 +790,11 @@ def verify_global_pin():
 
     pin_setting = Setting.query.get('global_pin_hash')
     if not pin_setting:
-        if pwd_context.verify(data['current_pin'], pwd_context.hash(DEFAULT_GLOBAL_PIN)):
+        if pin_pwd_context.verify(data['current_pin'], DEFAULT_GLOBAL_PIN_HASH):
              return jsonify({"status": "success", "message": "Default PIN verified"})
         else:
              return jsonify({"status": "error", "message": "No Global PIN currently set (default mismatch)"}), 403
-    elif pwd_context.verify(data['current_pin'], pin_setting.value):
+    elif pin_pwd_context.verify(data['current_pin'], pin_setting.value):
         return jsonify({"status": "success", "message": "Global PIN verified"})
     else:
         return jsonify({"status": "error", "message": "Incorrect Global PIN"}), 403
@@ -598,39 +811,53 @@ def update_global_pin():
          return jsonify({"status": "error", "message": "Invalid PIN format (must be 6 digits)"}), 400
 
     try:
-        pin_setting = Setting.query.get('global_pin_hash')
-        new_hash = pwd_context.hash(new_pin)
-        if pin_setting:
-            pin_setting.value = new_hash
-        else:
-            pin_setting = Setting(key='global_pin_hash', value=new_hash)
-            db.session.add(pin_setting)
+        new_hash = pin_pwd_context.hash(new_pin)
+        # Native upsert: one statement instead of SELECT-then-UPDATE/INSERT,
+        # which also closes the race between the check and the write
+        stmt = sqlite_insert(Setting).values(key='global_pin_hash', value=new_hash)
+        stmt = stmt.on_conflict_do_update(index_elements=['key'], set_={'value': new_hash})
+        db.session.execute(stmt)
         db.session.commit()
-        print("INFO: Global Keypad PIN updated.")
+        _invalidate_pin_hash_cache()
+        logger.info("INFO: Global Keypad PIN updated.")
         return jsonify({"status": "success", "message": "Global PIN updated successfully"})
     except Exception as e:
         db.session.rollback()
-        print(f"ERROR updating global PIN: {e}")
+        logger.error(f"ERROR updating global PIN: {e}")
         return jsonify({"status": "error", "message": "Database error updating global PIN"}), 500
 
 
 def perform_liveness_check(ir_dot_image_bgr, rgb_image):
     is_live = False
-    print("Image loaded successfully.")
+    logger.info("Image loaded successfully.")
     img_display = ir_dot_image_bgr.copy()
     gray = cv2.cvtColor(ir_dot_image_bgr, cv2.COLOR_BGR2GRAY)
     rgb_image = cv2.cvtColor(rgb_image, cv2.COLOR_BGR2RGB)
-    print("Loading Face Cascade...")
-    face_cascade = cv2.CascadeClassifier(FACE_CASCADE_PATH)
-    if face_cascade.empty(): print(f"ERROR: Failed to load Face Cascade from {FACE_CASCADE_PATH}"); exit()
-    print("Face Cascade loaded.")
+    logger.info("Loading Face Cascade...")
+    face_cascade = get_face_cascade()
+    if face_cascade.empty(): logger.error(f"ERROR: Failed to load Face Cascade from {FACE_CASCADE_PATH}"); exit()
+    logger.info("Face Cascade loaded.")
 
     # --- 1. Face Detection ---
-    print("Detecting faces...")
-    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(50, 50))
+    # Detect on a thumbnail (max side 320) and rescale the boxes: the Haar
+    # pyramid cost scales with frame area, and the downstream dot analysis
+    # only needs the box at full resolution.
+    logger.info("Detecting faces...")
+    detect_scale = min(1.0, 320 / max(gray.shape[:2]))
+    if detect_scale < 1.0:
+        detect_gray = cv2.resize(gray, None, fx=detect_scale, fy=detect_scale,
+                                 interpolation=cv2.INTER_AREA)
+        min_side = max(1, int(50 * detect_scale))
+    else:
+        detect_gray = gray
+        min_side = 50
+    faces = face_cascade.detectMultiScale(detect_gray, scaleFactor=1.1, minNeighbors=5,
+                                          minSize=(min_side, min_side))
+    if detect_scale < 1.0 and len(faces) > 0:
+        faces = [tuple(int(round(v / detect_scale)) for v in box) for box in faces]
 
     if len(faces) == 0:
-        print("No face detected in the image. Cannot proceed with dot analysis on face.")
+        logger.info("No face detected in the image. Cannot proceed with dot analysis on face.")
         # cv2.imshow("Original", ir_dot_image_bgr)
         # cv2.waitKey(0)
         # cv2.destroyAllWindows()
@@ -638,75 +865,99 @@ def perform_liveness_check(ir_dot_image_bgr, rgb_image):
 
     faces = sorted(faces, key=lambda f: f[2]*f[3], reverse=True)
     fx, fy, fw, fh = faces[0] # Bounding box of the primary face
-    print(f"Face detected at: x={fx}, y={fy}, w={fw}, h={fh}")
+    logger.info(f"Face detected at: x={fx}, y={fy}, w={fw}, h={fh}")
 
     # Draw face rectangle on display image
     cv2.rectangle(img_display, (fx, fy), (fx+fw, fy+fh), (255, 0, 0), 2) # Blue rectangle
 
-    # --- 2. Preprocessing (CLAHE on full grayscale) ---
-    print(f"Applying CLAHE...");
-    clahe = cv2.createCLAHE(clipLimit=CLAHE_CLIP_LIMIT, tileGridSize=CLAHE_TILE_GRID_SIZE)
-    gray = cv2.bitwise_not(gray)
-    gray_enhanced = clahe.apply(gray) 
-    print("CLAHE applied.")
-    # cv2.imshow("1. CLAHE Enhanced", gray_enhanced); cv2.waitKey(0) # Optional view
+    # --- 2. Preprocessing (CLAHE on the face ROI only) ---
+    # Only blobs inside the face box are ever kept, so CLAHE, thresholding,
+    # morphology, and blob detection all run on the ROI crop — the rest of the
+    # frame never enters the pipeline. The chain runs on a UMat so the T-API
+    # can keep it on an OpenCL device (or the vectorized CPU path) end to end,
+    # with a single readback before blob detection.
+    logger.info(f"Applying CLAHE...");
+    clahe = get_liveness_clahe()
+    roi_gray = np.ascontiguousarray(gray[fy:fy+fh, fx:fx+fw])
+    # No inversion pass: CLAHE equalizes either polarity, the threshold type
+    # encodes the bright-dot polarity, and the dot-intensity gather now reads
+    # true IR brightness (the old inverted gray biased it)
+    gray_enhanced = clahe.apply(cv2.UMat(roi_gray))
+    logger.info("CLAHE applied.")
+    # cv2.imshow("1. CLAHE Enhanced", gray_enhanced.get()); cv2.waitKey(0) # Optional view
 
     # --- 3. Adaptive Thresholding ---
-    print("Applying Adaptive Threshold...")
+    logger.info("Applying Adaptive Threshold...")
     thresh = cv2.adaptiveThreshold(gray_enhanced, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, thresh_type, thresh_block_size, thresh_C)
-    print("Adaptive thresholding complete.")
-    # cv2.imshow("2. Thresholded after CLAHE", thresh); cv2.waitKey(0) # Optional view
-
-    # --- 4. Morphological Opening ---
-    print("Applying Morphological Opening...")
-    kernel = np.ones((morph_kernel_size, morph_kernel_size), np.uint8)
-    opened = cv2.erode(thresh, kernel, iterations=morph_iterations)
-    opened = cv2.dilate(opened, kernel, iterations=morph_iterations)
-    print("Morphological Opening complete.")
-    # cv2.imshow("3. After Opening", opened); cv2.waitKey(0) # Optional view
-    image_for_blob_detection = opened
-
-    # --- 5. Blob Detection ---
-    print("Detecting blobs...")
-    detector = cv2.SimpleBlobDetector_create(blob_params)
-    all_keypoints = detector.detect(image_for_blob_detection)
-    print(f"Found {len(all_keypoints)} total blobs initially.")
+    logger.info("Adaptive thresholding complete.")
+    # cv2.imshow("2. Thresholded after CLAHE", thresh.get()); cv2.waitKey(0) # Optional view
+
+    # --- 4./5. Blob Extraction via Connected Components ---
+    # One CCA pass replaces the morphological opening and SimpleBlobDetector's
+    # internal multi-threshold sweep: the area filter subsumes the opening
+    # (speckles fall below minArea), and bounding-box fill/aspect stand in for
+    # the circularity and inertia filters.
+    logger.info("Extracting dot blobs (connected components)...")
+    thresh_np = thresh.get() # single readback from the T-API chain
+    nlabels, labels, stats, centroids = cv2.connectedComponentsWithStats(thresh_np, connectivity=8)
+    cc_areas = stats[1:, cv2.CC_STAT_AREA]
+    cc_w = stats[1:, cv2.CC_STAT_WIDTH].astype(np.float32)
+    cc_h = stats[1:, cv2.CC_STAT_HEIGHT].astype(np.float32)
+    cc_fill = cc_areas / np.maximum(cc_w * cc_h, 1) # a circle fills ~pi/4 of its bbox
+    cc_aspect = np.maximum(cc_w, cc_h) / np.maximum(np.minimum(cc_w, cc_h), 1)
+    cc_keep = ((cc_areas >= blob_params.minArea) & (cc_areas <= blob_params.maxArea) &
+               (cc_fill >= 0.6) & (cc_aspect <= 2.0))
+    dot_centroids = centroids[1:][cc_keep]
+    logger.info(f"Found {len(dot_centroids)} candidate blobs.")
 
     # --- 6. Filter Blobs to Keep Only Those Inside the Face ROI ---
-    print("Filtering blobs within face ROI...")
-    face_keypoints = []
-    face_dot_coords = [] 
-    face_dot_intensities = [] 
-
-    for kp in all_keypoints:
-        x, y = int(kp.pt[0]), int(kp.pt[1])
-        if fx < x < fx + fw and fy < y < fy + fh:
-            face_keypoints.append(kp)
-            face_dot_coords.append((x, y))
-            y_clamped = max(0, min(y, gray.shape[0] - 1))
-            x_clamped = max(0, min(x, gray.shape[1] - 1))
-            intensity = gray[y_clamped, x_clamped]
-            face_dot_intensities.append(intensity)
-            # Draw detected face dots on display image
-            cv2.circle(img_display, (x, y), 3, (0, 255, 0), -1) # Green dots
-
-    print(f"Found {len(face_keypoints)} blobs within the face ROI.")
+    # Vectorized bounds mask + fancy-indexed intensity gather
+    logger.info("Filtering blobs within face ROI...")
+    face_dot_coords = np.empty((0, 2), dtype=np.int32)
+    face_dot_intensities = np.empty(0, dtype=gray.dtype)
+
+    if len(dot_centroids) > 0:
+        pts_int = dot_centroids.astype(np.int32)
+        # Extraction ran on the ROI crop; shift back to frame coordinates
+        pts_int[:, 0] += fx
+        pts_int[:, 1] += fy
+        in_roi = ((pts_int[:, 0] > fx) & (pts_int[:, 0] < fx + fw) &
+                  (pts_int[:, 1] > fy) & (pts_int[:, 1] < fy + fh))
+        face_dot_coords = pts_int[in_roi]
+        ys_clamped = np.clip(face_dot_coords[:, 1], 0, gray.shape[0] - 1)
+        xs_clamped = np.clip(face_dot_coords[:, 0], 0, gray.shape[1] - 1)
+        face_dot_intensities = gray[ys_clamped, xs_clamped]
+        # Draw detected face dots on display image
+        for x, y in face_dot_coords:
+            cv2.circle(img_display, (int(x), int(y)), 3, (0, 255, 0), -1) # Green dots
+
+    logger.info(f"Found {len(face_dot_coords)} blobs within the face ROI.")
 
     # Optional: Display intermediate result
     #cv2.imshow("Detected Face & Dots", img_display)
     #cv2.waitKey(0)
 
 
-    # --- 7. Rudimentary 3D Visualization based on Intensity ---
-    if len(face_dot_coords) > 5:
-        print("Generating 3D plot (Intensity as Z)...")
-        points = np.array(face_dot_coords)
-        intensities = np.array(face_dot_intensities)
+    # --- 7. Rudimentary 3D Visualization based on Intensity (debug only) ---
+    dot_tri = None # Delaunay triangulation for the wireframe
+    if DEBUG_PLOT and len(face_dot_coords) > 5:
+        logger.info("Generating 3D plot (Intensity as Z)...")
+        # Already ndarrays from the vectorized filter; asarray avoids a copy
+        points = np.asarray(face_dot_coords)
+        intensities = np.asarray(face_dot_intensities)
 
         # Normalize intensities (0-255) to a Z range (e.g., 0-1 or inverted)
         # Assuming HIGHER intensity means CLOSER (less light absorbed) -> Lower Z
-        max_z_value = 50.0 
-        z_coords = max_z_value * (1.0 - (intensities / 255.0))
+        # In-place scale+shift: one float32 buffer instead of three temporaries
+        max_z_value = 50.0
+        z_coords = intensities.astype(np.float32)
+        z_coords *= -max_z_value / 255.0
+        z_coords += max_z_value
+
+        # Deferred imports: matplotlib and the Delaunay machinery only load
+        # in debug runs, not into every production server process
+        import matplotlib.pyplot as plt
+        from scipy.spatial import Delaunay
 
         fig = plt.figure(figsize=(8, 8))
         ax = fig.add_subplot(111, projection='3d')
@@ -716,21 +967,18 @@ def perform_liveness_check(ir_dot_image_bgr, rgb_image):
         ax.scatter(points[:, 0], -points[:, 1], z_coords, c=z_coords, cmap='viridis_r', marker='.')
 
         try:
-            from scipy.spatial import Delaunay
-            if len(points) >= 4: 
-                print("Attempting Delaunay triangulation for wireframe...")
-                tri = Delaunay(points) 
-                print(f"Triangulation found {len(tri.simplices)} triangles.")
+            if len(points) >= 4:
+                logger.info("Attempting Delaunay triangulation for wireframe...")
+                dot_tri = Delaunay(points)
+                logger.info(f"Triangulation found {len(dot_tri.simplices)} triangles.")
                 # Plot the wireframe using the calculated Z coordinates
-                ax.plot_trisurf(points[:, 0], -points[:, 1], z_coords, triangles=tri.simplices,
+                ax.plot_trisurf(points[:, 0], -points[:, 1], z_coords, triangles=dot_tri.simplices,
                                 cmap=plt.cm.viridis, #'viridis',
                                 linewidth=0.2, alpha=0.5, edgecolor='grey')
             else:
-                print("Not enough points for triangulation.")
-        except ImportError:
-            print("WARN: scipy.spatial.Delaunay not found. Cannot plot wireframe.")
+                logger.info("Not enough points for triangulation.")
         except Exception as tri_e:
-            print(f"ERROR during triangulation/plotting: {tri_e}")
+            logger.error(f"ERROR during triangulation/plotting: {tri_e}")
 
 
         ax.set_xlabel('X Coordinate (Image)')
@@ -738,42 +986,51 @@ def perform_liveness_check(ir_dot_image_bgr, rgb_image):
         ax.set_zlabel('Approx Depth (Intensity Based)')
         ax.set_title('Rudimentary 3D Point Cloud from Dot Intensity')
 
-    else:
-        print("Not enough face dots found to generate 3D plot.")
+    elif DEBUG_PLOT:
+        logger.info("Not enough face dots found to generate 3D plot.")
 
     heatmap_norm = None # Normalized heatmap (0-1)
     heatmap_vis = None # Visualizable heatmap (0-255)
     heatmap_color_masked = None # Colored/masked heatmap for overlay
+    heatmap_compare_gray = None # Grayscale blurred heatmap used for SSIM/MSE
     overlay = img_display.copy() # Start overlay with original image + face dots
 
     if len(face_dot_coords) > 5:
-        print("Generating intensity heatmap...")
-        points_xy = np.array(face_dot_coords)
-        intensities = np.array(face_dot_intensities)
-        # Normalize intensities (0-255) -> Higher intensity = Higher value (closer?)
+        logger.info("Generating intensity heatmap...")
+        points_xy = np.asarray(face_dot_coords) # ndarray already; no copy
+        intensities = np.asarray(face_dot_intensities)
+        # Normalize intensities (0-255) and invert -> brighter dot = lower value.
+        # The dots are sampled from the un-inverted IR frame (the old global
+        # bitwise_not pass is gone), while the pseudo-depth map this heatmap is
+        # SSIM-compared against is generated with invert_colormap=True, so the
+        # inversion has to happen here for the polarities to match.
         # Keep this in 0-1 range
-        normalized_z_intensity = intensities / 255.0
+        normalized_z_intensity = 1.0 - intensities / 255.0
 
-        grid_x, grid_y = np.mgrid[fx:fx+fw, fy:fy+fh]
         try:
-            print(f"Interpolating {len(points_xy)} points...")
-            heatmap_norm = griddata(points_xy, normalized_z_intensity, (grid_x, grid_y),
-                                    method='linear', fill_value=np.nan) 
-            heatmap_norm = heatmap_norm.T
-
-            if np.isnan(heatmap_norm).any():
-                median_val = np.nanmedian(heatmap_norm)
-                if np.isnan(median_val): median_val = 0 
-                heatmap_norm = np.nan_to_num(heatmap_norm, nan=median_val)
-                print(f"INFO: Replaced NaNs in intensity heatmap with median value: {median_val:.3f}")
+            logger.info(f"Splatting {len(points_xy)} points...")
+            # Splat-and-blur instead of dense triangulated interpolation: the
+            # consumer only sees this map after the vignette and a 45x45 blur,
+            # so scattering intensities at dot positions and normalizing by a
+            # blurred weight image gives an equivalent low-frequency heatmap
+            # in two C-level passes over the ROI.
+            acc = np.zeros((fh, fw), np.float32)
+            wt = np.zeros_like(acc)
+            xs_local = np.clip(points_xy[:, 0] - fx, 0, fw - 1)
+            ys_local = np.clip(points_xy[:, 1] - fy, 0, fh - 1)
+            acc[ys_local, xs_local] = normalized_z_intensity
+            wt[ys_local, xs_local] = 1.0
+            cv2.sepFilter2D(acc, -1, LIVENESS_BLUR_K1D, LIVENESS_BLUR_K1D, dst=acc)
+            cv2.sepFilter2D(wt, -1, LIVENESS_BLUR_K1D, LIVENESS_BLUR_K1D, dst=wt)
+            heatmap_norm = acc / np.maximum(wt, 1e-6)
 
 
             # --- Visualization Part ---
             heatmap_vis = cv2.normalize(heatmap_norm, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
             heatmap_color = cv2.applyColorMap(heatmap_vis, cv2.COLORMAP_JET)
-            mask = np.zeros(ir_dot_image_bgr.shape[:2], dtype="uint8")
-            cv2.rectangle(mask, (fx, fy), (fx+fw, fy+fh), 255, -1)
-            mask_roi = mask[fy:fy+fh, fx:fx+fw]
+            # Only the ROI slice of the old full-frame rect mask was ever read,
+            # and it is all-255 there, so allocate just that
+            mask_roi = np.full((fh, fw), 255, dtype=np.uint8)
             if heatmap_color.shape[:2] == mask_roi.shape:
                 heatmap_color_masked = cv2.bitwise_and(heatmap_color, heatmap_color, mask=mask_roi)
                 roi_overlay = overlay[fy:fy+fh, fx:fx+fw]
@@ -785,45 +1042,46 @@ def perform_liveness_check(ir_dot_image_bgr, rgb_image):
                                               scale_x=0.85,  # Wider ellipse
                                               scale_y=0.95,  # Shorter ellipse
                                               feather_sigma=0.0)
-                    heatmap_color = cv2.GaussianBlur(heatmap_color, (45,45), 0)
-                else: print("WARN: Shape mismatch between heatmap color ROI and overlay ROI.")
-            else: print("WARN: Shape mismatch between heatmap color and mask ROI.")
+                    # SSIM only ever consumes the grayscale version, so convert
+                    # before the big blur (one channel instead of three) and
+                    # run the explicitly separable form with the cached kernel
+                    heatmap_compare_gray = cv2.cvtColor(heatmap_color, cv2.COLOR_BGR2GRAY)
+                    heatmap_compare_gray = cv2.sepFilter2D(heatmap_compare_gray, -1,
+                                                           LIVENESS_BLUR_K1D, LIVENESS_BLUR_K1D)
+                else: logger.warning("WARN: Shape mismatch between heatmap color ROI and overlay ROI.")
+            else: logger.warning("WARN: Shape mismatch between heatmap color and mask ROI.")
 
-            print("Intensity heatmap generated and normalized (0-1).")
+            logger.info("Intensity heatmap generated and normalized (0-1).")
 
         except Exception as e:
-            print(f"ERROR generating intensity heatmap: {e}"); traceback.print_exc()
+            logger.error(f"ERROR generating intensity heatmap: {e}"); traceback.print_exc()
             heatmap_norm = None
     else:
-        print("Not enough face dots found to generate intensity heatmap.")
+        logger.info("Not enough face dots found to generate intensity heatmap.")
 
 
     # --- 8. Depth Model Prediction & Comparison ---
     is_live = False # Default to not live
     similarity_score = -1.0 # Default score
 
-    #creating temp ir storage
-    temp_ir_path = None
+    #creating temp rgb storage (DeepFace wants a path; the IR frame goes in-memory)
+    temp_rgb_path = None
     try:
-        temp_filename = f"temp_ir_{uuid.uuid4().hex}.jpg"
-        temp_dir = tempfile.gettempdir()
-        temp_ir_path = os.path.join(temp_dir, temp_filename)
-
-        save_success = cv2.imwrite(temp_ir_path, ir_dot_image_bgr)
-
         temp_rgb_filename = f"rgb_{uuid.uuid4().hex}.jpg"
         temp_rgb_dir = tempfile.gettempdir()
         temp_rgb_path = os.path.join(temp_rgb_dir, temp_rgb_filename)
 
         save_success_rgb = cv2.imwrite(temp_rgb_path, rgb_image)
 
-        if not save_success and not save_success_rgb:
+        if not save_success_rgb:
             raise IOError("Failed to save temporary image using cv2.imwrite")
-        print("INFO: Temporary image saved successfully.")
+        logger.info("INFO: Temporary image saved successfully.")
 
         if heatmap_norm is not None:
+            # Pass the decoded frame directly — no JPEG encode to disk and
+            # decode back just to hand it to the generator
             processed_maps, original_with_boxes, face_coords = generate_face_pseudo_depth_maps(
-                image_path=temp_ir_path,
+                image=ir_dot_image_bgr,
                 haar_cascade_path=FACE_CASCADE_PATH,
                 display_size=(600, 600),
                 apply_colormap=True,
@@ -837,34 +1095,47 @@ def perform_liveness_check(ir_dot_image_bgr, rgb_image):
                 #cv2.waitKey(0)
                 pass
 
-            gray_dots = cv2.cvtColor(heatmap_color, cv2.COLOR_BGR2GRAY)
-            gray_model = cv2.cvtColor(processed_maps[0], cv2.COLOR_BGR2GRAY)
-
-            h_dots, w_dots = gray_dots.shape
-            h_model, w_model = gray_model.shape
-
-            if (h_dots, w_dots) != (h_model, w_model):
-                print(f"Resizing New Method map from {w_model}x{h_model} to {w_dots}x{h_dots}...")
-                gray_model_resized = cv2.resize(gray_model, (w_dots, h_dots), interpolation=cv2.INTER_LINEAR) # Or INTER_CUBIC
-            else:
-                gray_model_resized = gray_model
-            print("Images are now the same size.")
+            # Compare at a fixed small size: both maps are low-frequency after
+            # the 45x45 blur, so nothing is lost, and SSIM's sliding window
+            # cost scales with area (600x600 -> 64x64 is ~90x less work; the
+            # 7px window still spans ~1/9 of the map, comparable coverage to
+            # the blur kernel at full resolution)
+            if heatmap_compare_gray is None: # shape-mismatch fallback above
+                heatmap_compare_gray = cv2.cvtColor(heatmap_color, cv2.COLOR_BGR2GRAY)
+            gray_dots = cv2.resize(heatmap_compare_gray,
+                                   SSIM_COMPARE_SIZE, interpolation=cv2.INTER_AREA)
+            gray_model_resized = cv2.resize(cv2.cvtColor(processed_maps[0], cv2.COLOR_BGR2GRAY),
+                                            SSIM_COMPARE_SIZE, interpolation=cv2.INTER_AREA)
+            logger.info("Images are now the same size.")
 
             try:
-                score_ssim, diff = ssim(gray_dots, gray_model_resized, full=True, data_range=gray_dots.max() - gray_dots.min())
-                print(f"\nStructural Similarity Index (SSIM): {score_ssim:.4f}")
-                print("(Value closer to 1 means more similar)")
+                # ascontiguousarray is a no-op for already-contiguous inputs but
+                # keeps SSIM's sliding window off its internal-copy slow path
+                # full=False skips building the per-pixel similarity image
+                # (it was never consumed), and data_range is the intrinsic
+                # uint8 range rather than the observed max-min, which shrank
+                # with image content and inflated scores
+                # win_size/gaussian_weights pinned to the cheap box-filter
+                # defaults so an skimage upgrade can't silently switch them
+                score_ssim = ssim(np.ascontiguousarray(gray_dots),
+                                  np.ascontiguousarray(gray_model_resized),
+                                  full=False, data_range=255,
+                                  win_size=7, gaussian_weights=False)
+                logger.info(f"\nStructural Similarity Index (SSIM): {score_ssim:.4f}")
+                logger.info("(Value closer to 1 means more similar)")
             except Exception as e:
-                print(f"\nERROR calculating SSIM: {e}")
-                print("Ensure scikit-image is installed: pip install scikit-image")
+                logger.error(f"\nERROR calculating SSIM: {e}")
+                logger.info("Ensure scikit-image is installed: pip install scikit-image")
                 score_ssim = None
 
             try:
-                mse = np.mean((gray_dots.astype("float") - gray_model_resized.astype("float")) ** 2)
-                print(f"\nMean Squared Error (MSE): {mse:.2f}")
-                print("(Lower value means more similar)")
+                # absdiff keeps it in uint8; only the squared sum widens
+                mse_diff = cv2.absdiff(gray_dots, gray_model_resized)
+                mse = float(np.mean(mse_diff.astype(np.uint32) ** 2))
+                logger.info(f"\nMean Squared Error (MSE): {mse:.2f}")
+                logger.info("(Lower value means more similar)")
             except Exception as e:
-                print(f"\nERROR calculating MSE: {e}")
+                logger.error(f"\nERROR calculating MSE: {e}")
                 mse = None
 
             # --- Liveness Decision Placeholder ---
@@ -873,7 +1144,7 @@ def perform_liveness_check(ir_dot_image_bgr, rgb_image):
                 SSIM_LIVENESS_THRESHOLD = 0.6
                 # ---------------------------
                 is_live = score_ssim > SSIM_LIVENESS_THRESHOLD
-                print(f"\nLiveness Estimate (SSIM > {SSIM_LIVENESS_THRESHOLD}): {'Likely LIVE' if is_live else 'Likely SPOOF / Dissimilar'}")
+                logger.info(f"\nLiveness Estimate (SSIM > {SSIM_LIVENESS_THRESHOLD}): {'Likely LIVE' if is_live else 'Likely SPOOF / Dissimilar'}")
                 if is_live:
                     try:
                         face_objs = DeepFace.extract_faces(
@@ -883,21 +1154,24 @@ def perform_liveness_check(ir_dot_image_bgr, rgb_image):
                         anti_spoofing = True
                         )
                         for face_obj in face_objs:
-                            print("Real Face: ",face_obj["is_real"])
+                            logger.info(f"Real Face: {face_obj['is_real']}")
                         if face_objs[0]["is_real"]:
                             is_live=True
                         else:
                             is_live=False
                     except:
                         is_live=False
-                        cv2.imshow("RGB_Test",cv2.imread(temp_rgb_path))
-                        cv2.waitKey(0)
-                        print("Real Face: False -Er")
+                        if DEBUG_PLOT:
+                            # blocking waitKey stalls the whole worker thread;
+                            # only useful when someone is at the console
+                            cv2.imshow("RGB_Test",cv2.imread(temp_rgb_path))
+                            cv2.waitKey(0)
+                        logger.info("Real Face: False -Er")
             elif mse is not None:
                 # Lower MSE is better.
                 MSE_LIVENESS_THRESHOLD = 4000 # EXAMPLE
                 is_live = mse < MSE_LIVENESS_THRESHOLD
-                print(f"\nLiveness Estimate (MSE < {MSE_LIVENESS_THRESHOLD}): {'Likely LIVE' if is_live else 'Likely SPOOF / Dissimilar'}")
+                logger.info(f"\nLiveness Estimate (MSE < {MSE_LIVENESS_THRESHOLD}): {'Likely LIVE' if is_live else 'Likely SPOOF / Dissimilar'}")
                 if is_live:
                     try:
                         face_objs = DeepFace.extract_faces(
@@ -907,38 +1181,37 @@ def perform_liveness_check(ir_dot_image_bgr, rgb_image):
                         anti_spoofing = True
                         )
                         for face_obj in face_objs:
-                            print("Real Face: ",face_obj["is_real"])
+                            logger.info(f"Real Face: {face_obj['is_real']}")
                         if face_objs[0]["is_real"]:
                             is_live=True
                         else:
                             is_live=False
                     except:
                         is_live=False
-                        print("Real Face: False - Er")
+                        logger.info("Real Face: False - Er")
 
         else:
-            print("Skipping depth comparison due to previous errors.")
+            logger.info("Skipping depth comparison due to previous errors.")
 
     except Exception as e:
-        print(f"ERROR during temporary file handling or function call: {e}")
+        logger.error(f"ERROR during temporary file handling or function call: {e}")
         traceback.print_exc()
 
     finally:
-        if temp_ir_path and os.path.exists(temp_ir_path) and temp_rgb_path and os.path.exists(temp_rgb_path):
+        if temp_rgb_path and os.path.exists(temp_rgb_path):
             try:
-                print(f"INFO: Deleting temporary files: {temp_ir_path} and {temp_rgb_path}")
-                os.remove(temp_ir_path)
+                logger.info(f"INFO: Deleting temporary file: {temp_rgb_path}")
                 os.remove(temp_rgb_path)
-                print("INFO: Temporary file deleted.")
+                logger.info("INFO: Temporary file deleted.")
             except Exception as e_remove:
-                print(f"WARN: Failed to delete temporary file {temp_ir_path}: {e_remove}")
+                logger.warning(f"WARN: Failed to delete temporary file {temp_rgb_path}: {e_remove}")
     
     return is_live
 
 # --- Endpoints for Pi Interaction ---
 @app.route('/recognize', methods=['POST'])
 def recognize_face_from_pi():
-    print("\n--- New Recognition Request (Multi-Frame) ---")
+    logger.info("\n--- New Recognition Request (Multi-Frame) ---")
     required_files = ['ir_image', 'rgb_image_1', 'rgb_image_2', 'rgb_image_3']
     if not all(key in request.files for key in required_files):
         missing = [key for key in required_files if key not in request.files]
@@ -950,7 +1223,7 @@ def recognize_face_from_pi():
 
     try:
         # --- 2. Decode Images ---
-        print("INFO: Decoding received images...")
+        logger.info("INFO: Decoding received images...")
         decoded_images = {}
         try:
             for key, file_storage in files.items():
@@ -958,66 +1231,88 @@ def recognize_face_from_pi():
                 img_bgr = cv2.imdecode(img_bytes, cv2.IMREAD_COLOR)
                 if img_bgr is None: raise ValueError(f"Failed to decode {key}")
                 decoded_images[key] = img_bgr
-            print("INFO: All images decoded successfully.")
+            logger.info("INFO: All images decoded successfully.")
         except Exception as decode_err:
-             print(f"ERROR: Image decoding failed: {decode_err}")
+             logger.error(f"ERROR: Image decoding failed: {decode_err}")
              return jsonify({"status": "error", "message": "Could not decode images"}), 400
 
         # --- 3. Perform Liveness Check on IR Dot Image ---
         is_live = perform_liveness_check(decoded_images['ir_image'], decoded_images["rgb_image_1"]) # Pass IR image and 1st RGB Frame
 
         if not is_live:
-            print("WARN: Liveness Check FAILED (Potential Spoof).")
+            logger.warning("WARN: Liveness Check FAILED (Potential Spoof).")
             try: # Log Intruder
                 pass
                 #intruder_filename=f"intruder_liveness_fail_{uuid.uuid4().hex}.jpg"; intruder_save_path=os.path.join(app.config['UPLOAD_FOLDER_INTRUDER'], intruder_filename); cv2.imwrite(intruder_save_path, decoded_images['rgb_image_1']); new_log=Log(type="Intruder", details="Liveness check failed.", image_path=intruder_filename); db.session.add(new_log); db.session.commit(); print(f"Logged Intruder: {intruder_filename}")
-            except Exception as log_err: print(f"ERROR logging intruder: {log_err}"); db.session.rollback()
+            except Exception as log_err: logger.error(f"ERROR logging intruder: {log_err}"); db.session.rollback()
             return jsonify({"status": "error", "message": "Liveness Check Failed", "liveness_failed": True})
 
 
         # --- 4. Liveness Passed - Perform Multi-Frame Face Recognition ---
-        print("INFO: Liveness check passed. Performing multi-frame face recognition...")
+        logger.info("INFO: Liveness check passed. Performing multi-frame face recognition...")
         recognition_results = [] # Store results for each frame
         rgb_keys = ['rgb_image_1', 'rgb_image_2', 'rgb_image_3']
 
         for key in rgb_keys:
-            recognition_image_bgr = cv2.cvtColor(decoded_images[key], cv2.COLOR_BGR2RGB) 
+            # DeepFace treats ndarray inputs as BGR, which is what imdecode
+            # produced - the old BGR2RGB flip here cost a full-image copy
+            # and handed the models swapped channels
+            recognition_image_bgr = decoded_images[key]
             frame_result_name = "Error"
             frame_result_id = None
             frame_result_dist = float('inf')
 
             try:
-                print(f"INFO: Running DeepFace.find on {key}...")
-                dfs = DeepFace.find(
-                    img_path=recognition_image_bgr, db_path=KNOWN_FACES_PATH,
-                    model_name=DEEPFACE_MODEL_NAME, detector_backend=DEEPFACE_DETECTOR_BACKEND,
-                    enforce_detection=False, silent=False
-                )
-
-                if dfs and isinstance(dfs, list) and len(dfs) > 0 and not dfs[0].empty:
-                    df = dfs[0].sort_values(by='distance')
-                    if not df.empty:
-                        best_match = df.iloc[0]
-                        distance = best_match['distance']
-                        frame_result_dist = distance
-                        if distance < DEEPFACE_RECOGNITION_THRESHOLD:
-                            identity_path = best_match['identity']
-                            try:
-                                 frame_result_id = os.path.basename(os.path.dirname(identity_path))
-                                 matched_user = User.query.get(frame_result_id)
-                                 frame_result_name = matched_user.name if matched_user else "Known(ID Err)"
-                            except Exception as path_e: frame_result_name = "Known(Path Err)"
-                        else:
-                             frame_result_name = "Unknown"
+                if face_index.ready:
+                    # One represent() call + index lookup instead of
+                    # DeepFace.find's pickle reload and full linear scan
+                    logger.info(f"INFO: Querying face index for {key}...")
+                    matched_id, distance = face_index.query(recognition_image_bgr)
+                    frame_result_dist = distance
+                    if matched_id is None:
+                        frame_result_name = "No Face (DeepFace)"
+                    elif distance < DEEPFACE_RECOGNITION_THRESHOLD:
+                        frame_result_id = matched_id
+                        matched_user = User.query.get(frame_result_id)
+                        frame_result_name = matched_user.name if matched_user else "Known(ID Err)"
+                    else:
+                        frame_result_name = "Unknown"
                 else:
-                     frame_result_name = "No Face (DeepFace)"
+                    # Fallback when the index could not be built (e.g. empty
+                    # known_faces on first boot)
+                    logger.info(f"INFO: Running DeepFace.find on {key}...")
+                    dfs = DeepFace.find(
+                        img_path=recognition_image_bgr, db_path=KNOWN_FACES_PATH,
+                        model_name=DEEPFACE_MODEL_NAME, detector_backend=DEEPFACE_DETECTOR_BACKEND,
+                        enforce_detection=False, silent=False
+                    )
+
+                    if dfs and isinstance(dfs, list) and len(dfs) > 0 and not dfs[0].empty:
+                        df = dfs[0]
+                        if not df.empty:
+                            # idxmin is one vectorised pass; no need to sort
+                            # the whole frame to take its minimum row
+                            best_match = df.loc[df['distance'].idxmin()]
+                            distance = best_match['distance']
+                            frame_result_dist = distance
+                            if distance < DEEPFACE_RECOGNITION_THRESHOLD:
+                                identity_path = best_match['identity']
+                                try:
+                                     frame_result_id = os.path.basename(os.path.dirname(identity_path))
+                                     matched_user = User.query.get(frame_result_id)
+                                     frame_result_name = matched_user.name if matched_user else "Known(ID Err)"
+                                except Exception as path_e: frame_result_name = "Known(Path Err)"
+                            else:
+                                 frame_result_name = "Unknown"
+                    else:
+                         frame_result_name = "No Face (DeepFace)"
 
             except Exception as find_err:
-                print(f"ERROR: DeepFace.find failed for {key}: {find_err}"); traceback.print_exc()
+                logger.error(f"ERROR: Recognition failed for {key}: {find_err}"); traceback.print_exc()
                 frame_result_name = "Recognition Error"
 
             recognition_results.append((frame_result_name, frame_result_id, frame_result_dist))
-            print(f"INFO: Result for {key}: Name='{frame_result_name}', ID='{frame_result_id}', Dist={frame_result_dist if frame_result_dist!=float('inf') else 'N/A'}")
+            logger.info(f"INFO: Result for {key}: Name='{frame_result_name}', ID='{frame_result_id}', Dist={frame_result_dist if frame_result_dist!=float('inf') else 'N/A'}")
 
 
         # --- 5. Aggregate Results & Make Decision ---
@@ -1055,24 +1350,27 @@ def recognize_face_from_pi():
         elif max_matches > 0:
              final_log_details = f"Access denied: Inconsistent face matches (best had {max_matches}/{N_REQUIRED_MATCHES} needed)."
 
-        # --- 6. Log Final Access Attempt ---
-        log_type = "Access"
-        user_to_log = User.query.get(final_recognized_user_id) if final_recognized_user_id else None
-        new_log = Log( type=log_type, details=final_log_details, user_id=user_to_log.id if user_to_log else None )
+        # --- 6. Log Final Access Attempt (off the request path) ---
         if final_recognized_name == "Unknown":
+            log_type = "Intruder"
             intruder_filename=f"intruder_{uuid.uuid4().hex}.jpg"
             intruder_save_path=os.path.join(app.config['UPLOAD_FOLDER_INTRUDER'], intruder_filename)
             cv2.imwrite(intruder_save_path, cv2.cvtColor(decoded_images['rgb_image_1'], cv2.COLOR_BGR2RGB))
-            new_log = Log(type="Intruder", details=final_log_details, image_path=intruder_filename)
-        db.session.add(new_log); db.session.commit()
-        print(f"Logged final event: {log_type} - {final_log_details}")
+            new_log = Log(type=log_type, details=final_log_details, image_path=intruder_filename)
+        else:
+            log_type = "Access"
+            # final_recognized_user_id came from the DB lookup above; no
+            # need to fetch the user row again just for its id
+            new_log = Log(type=log_type, details=final_log_details, user_id=final_recognized_user_id)
+        LOG_QUEUE.put(new_log)
+        logger.info(f"Queued final event: {log_type} - {final_log_details}")
 
         # --- 7. Return Final Result to Pi ---
         return jsonify({"status": "success", "name": final_recognized_name})
 
     # --- Outer Error Handling ---
     except Exception as e:
-        print(f"!!!!!!!!!!!!!! RECOGNIZE EXCEPTION (Outer Handler) !!!!!!!!!!!!!!"); traceback.print_exc(); print(f"!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
+        logger.error(f"!!!!!!!!!!!!!! RECOGNIZE EXCEPTION (Outer Handler) !!!!!!!!!!!!!!"); traceback.print_exc(); logger.error(f"!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
         # ... (Log system error) ...
         return jsonify({"status": "error", "message": f"Internal Server Error: {type(e).__name__}"}), 500
 
@@ -1084,38 +1382,32 @@ def verify_keypad_code():
     if not data or 'code' not in data:
         return jsonify({"status": "error", "message": "Missing code"}), 400
 
+    # Reject floods before paying for bcrypt (pwd verify is ~100ms by design)
+    if _keypad_rate_limited(request.remote_addr):
+        logger.warning(f"WARN: Keypad rate limit hit for {request.remote_addr}.")
+        LOG_QUEUE.put(Log(type="Keypad Failure", details="Keypad attempt rate limit exceeded."))
+        return jsonify({"status": "error", "message": "Too many attempts, try again later"}), 429
+
     entered_code = data['code']
     pin_valid = False
     log_details = f"Keypad attempt with code: {'*' * len(entered_code)}."
 
-    # Fetch global PIN hash from settings
-    pin_setting = Setting.query.get('global_pin_hash')
-    current_pin_hash = None
-    if pin_setting:
-        current_pin_hash = pin_setting.value
-    else:
-        # If not set in DB, use hash of the default code
-        current_pin_hash = pwd_context.hash(DEFAULT_GLOBAL_PIN)
-        print(f"WARN: Global PIN not set in DB, checking against default ({DEFAULT_GLOBAL_PIN}).")
+    # Fetch global PIN hash (TTL-cached; invalidated on admin update)
+    current_pin_hash = _get_global_pin_hash()
 
-    if pwd_context.verify(entered_code, current_pin_hash):
+    if pin_pwd_context.verify(entered_code, current_pin_hash):
          pin_valid = True
          log_details = "Keypad unlock successful (Global PIN)."
-         print("INFO: Keypad code verified successfully (Global PIN).")
+         logger.info("INFO: Keypad code verified successfully (Global PIN).")
     else:
          log_details += " Incorrect Global PIN."
-         print("INFO: Keypad code verification failed (Global PIN).")
+         logger.info("INFO: Keypad code verification failed (Global PIN).")
 
     # Logging
     log_type = "Keypad Success" if pin_valid else "Keypad Failure"
-    try:
-        new_log = Log(type=log_type, details=log_details)
-        db.session.add(new_log)
-        db.session.commit()
-        print(f"Logged keypad event: {log_type}")
-    except Exception as e:
-        db.session.rollback()
-        print(f"ERROR logging keypad event after verification: {e}")
+    # Queued to the background log writer - no commit/fsync on the keypad path
+    LOG_QUEUE.put(Log(type=log_type, details=log_details))
+    logger.info(f"Queued keypad event: {log_type}")
 
     if pin_valid:
         return jsonify({"status": "success", "message": "PIN verified"})
@@ -1136,22 +1428,22 @@ def log_intruder_event():
             ext = file.filename.rsplit('.', 1)[1].lower()
             filename = f"intruder_{uuid.uuid4().hex}.{ext}"
             save_path = os.path.join(app.config['UPLOAD_FOLDER_INTRUDER'], filename)
-            file.save(save_path)
+            # Stream straight to disk in 1MB chunks instead of Werkzeug's
+            # default small-buffer save
+            with open(save_path, 'wb') as dst:
+                shutil.copyfileobj(file.stream, dst, length=1 << 20)
 
-            # Create log entry
-            new_log = Log(
+            # Create log entry (queued; the background writer batches commits)
+            LOG_QUEUE.put(Log(
                 type="Intruder",
                 details="Potential intruder detected.",
                 image_path=filename
-            )
-            db.session.add(new_log)
-            db.session.commit()
-            print(f"Logged Intruder event, image saved as {filename}")
+            ))
+            logger.info(f"Queued Intruder event, image saved as {filename}")
             return jsonify({"status": "success", "message": "Intruder event logged"}), 201
 
         except Exception as e:
-            db.session.rollback()
-            print(f"ERROR logging intruder event: {e}")
+            logger.error(f"ERROR logging intruder event: {e}")
             return jsonify({"status": "error", "message": f"Failed to log intruder event: {e}"}), 500
     else:
         return jsonify({"status": "error", "message": "File type not allowed"}), 400
@@ -1159,30 +1451,44 @@ def log_intruder_event():
 
 @app.route('/uploads/intruder_images/<filename>')
 def serve_intruder_image(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER_INTRUDER'], filename)
+    # Intruder images are uuid-named and never rewritten, so let clients
+    # cache them instead of re-fetching per log-screen visit
+    return send_from_directory(app.config['UPLOAD_FOLDER_INTRUDER'], filename, max_age=3600)
+
+@lru_cache(maxsize=256)
+def _user_face_dir(user_id):
+    """Absolute path of a user's known-faces folder (pure string work, cached)."""
+    return os.path.abspath(os.path.join(KNOWN_FACES_PATH, user_id))
+
 
 @app.route('/known_faces/<user_id>/<filename>')
-@token_required 
+@token_required
 def serve_known_face(user_id, filename):
     if g.current_user.role != 'Admin' and g.current_user.id != user_id:
         return jsonify({"status": "error", "message": "Permission denied to view this image"}), 403
+    # user_id feeds a path join before any filesystem check, so reject
+    # traversal outright (secure_filename below covers the filename part)
+    if '..' in user_id or '/' in user_id or '\\' in user_id:
+        return jsonify({"status": "error", "message": "Invalid user id"}), 400
 
-    user_face_dir = os.path.join(KNOWN_FACES_PATH, user_id)
     safe_filename = secure_filename(filename)
-    abs_directory = os.path.abspath(user_face_dir) # For logging
-    file_path = os.path.join(abs_directory, safe_filename) # For logging
+    abs_directory = _user_face_dir(user_id)
+    file_path = os.path.join(abs_directory, safe_filename)
 
-    print(f"--- SERVE KNOWN_FACE / AVATAR ---")
-    print(f"User: {user_id}, File: {filename} -> {safe_filename}")
-    print(f"Serving Directory (Absolute): {abs_directory}")
-    print(f"Attempting File: {file_path}")
-    print(f"File Exists Check: {os.path.exists(file_path)}")
+    # One stat instead of separate isdir/exists probes (a missing directory
+    # and a missing file both land in the same 404)
+    try:
+        os.stat(file_path)
+    except OSError:
+        return jsonify({"status": "error", "message": "Image not found"}), 404
 
-    if not os.path.isdir(user_face_dir): return jsonify({"status": "error", "message": "User directory not found"}), 404
+    logger.debug(f"Serving known_face {user_id}/{safe_filename}")
     try:
-        return send_from_directory(user_face_dir, safe_filename)
+        # Face images are uuid-named (a replaced face gets a new name), so an
+        # avatar grid can cache them client-side instead of re-requesting
+        return send_from_directory(abs_directory, safe_filename, max_age=3600)
     except Exception as e:
-        print(f"ERROR in send_from_directory for known_face {safe_filename}: {e}")
+        logger.error(f"ERROR in send_from_directory for known_face {safe_filename}: {e}")
         traceback.print_exc()
         return jsonify({"status": "error", "message": "Error serving file"}), 500
 
@@ -1191,27 +1497,55 @@ def serve_known_face(user_id, filename):
 if __name__ == '__main__':
     with app.app_context():
         from flask import g
-        print("Checking database schema...")
+        logger.info("Checking database schema...")
         db.create_all()
-        print("Database schema checked/updated.")
+        logger.info("Database schema checked/updated.")
 
         # Initialize default global PIN if not set
         if not Setting.query.get('global_pin_hash'):
-             print(f"Setting default Global Keypad PIN ({DEFAULT_GLOBAL_PIN})...")
-             default_pin_hash = pwd_context.hash(DEFAULT_GLOBAL_PIN)
+             logger.info(f"Setting default Global Keypad PIN ({DEFAULT_GLOBAL_PIN})...")
+             default_pin_hash = DEFAULT_GLOBAL_PIN_HASH
              new_setting = Setting(key='global_pin_hash', value=default_pin_hash)
              db.session.add(new_setting)
              db.session.commit()
-             print("Default Global PIN set.")
+             logger.info("Default Global PIN set.")
 
         if not User.query.filter_by(email='admin@neuralock.local').first():
-             print("Creating default admin user...")
+             logger.info("Creating default admin user...")
              admin = User(id=str(uuid.uuid4()), email='admin@neuralock.local', name='Admin User', role='Admin')
              admin.set_password('password') # CHANGE THIS DEFAULT PASSWORD
              db.session.add(admin)
              db.session.commit()
-             print("Default admin created (email: admin@neuralock.local, pass: password)")
+             logger.info("Default admin created (email: admin@neuralock.local, pass: password)")
 
-    print(f"Starting Flask server with Waitress...")
+    # Pay one-off liveness setup (cascade parse, CLAHE, blob detector,
+    # pseudo-depth caches) at startup instead of on the first unlock attempt
+    logger.info("Preparing face index...")
+    try:
+        face_index.ensure_ready()
+        logger.info(f"Face index ready ({len(face_index)} embeddings).")
+    except Exception as idx_err:
+        logger.warning(f"WARN: Face index unavailable (DeepFace.find fallback will be used): {idx_err}")
+
+    logger.info("Warming liveness pipeline caches...")
+    try:
+        # Opt in to OpenCL so the UMat stages (CLAHE, adaptive threshold,
+        # face detect) dispatch to an iGPU where one exists; OpenCV falls
+        # back to its CPU kernels silently if OpenCL is unavailable
+        cv2.ocl.setUseOpenCL(True)
+        logger.info(f"OpenCL available: {cv2.ocl.haveOpenCL()}")
+        get_face_cascade(); get_liveness_clahe()
+        pseudo_depth_warmup(haar_cascade_path=FACE_CASCADE_PATH)
+        logger.info("Liveness pipeline caches warm.")
+    except Exception as warm_err:
+        logger.warning(f"WARN: Liveness warmup failed (continuing): {warm_err}")
+
+    logger.info(f"Starting Flask server with Waitress...")
     from waitress import serve
-    serve(app, host='0.0.0.0', port=5000, threads=8)
+    # Waitress's thread pool is what overlaps requests here: the heavy
+    # OpenCV/BLAS/TF work releases the GIL, so while one thread is inside
+    # inference another can be receiving an upload. Size it to the host
+    # via env instead of the hardcoded 8.
+    server_threads = int(os.environ.get('SERVER_THREADS', max(8, (os.cpu_count() or 4) * 2)))
+    logger.info(f"Waitress thread pool: {server_threads} threads")
+    serve(app, host='0.0.0.0', port=5000, threads=server_threads)
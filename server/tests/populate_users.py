@@ -1,9 +1,14 @@
 # populate_users.py
 import os
-import uuid
-from recognition_server import app, db, User, pwd_context, KNOWN_FACES_PATH 
+import re
+from recognition_server import app, db, User, pwd_context, KNOWN_FACES_PATH
 
-DEFAULT_TEMP_PASSWORD = "changeme123" 
+DEFAULT_TEMP_PASSWORD = "changeme123"
+
+# Folder names are validated with a regex instead of try/except around
+# uuid.UUID() - no exception machinery or UUID object per folder
+_UUID4_RE = re.compile(
+    r'^[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}$', re.I)
 
 def run():
     print("Scanning known_faces directory...")
@@ -12,8 +17,10 @@ def run():
         return
 
     with app.app_context(): # Need app context for DB operations
-        found_folders = [d for d in os.listdir(KNOWN_FACES_PATH)
-                         if os.path.isdir(os.path.join(KNOWN_FACES_PATH, d))]
+        # scandir caches the file type from the directory read itself,
+        # avoiding a separate stat() per entry
+        with os.scandir(KNOWN_FACES_PATH) as entries:
+            found_folders = [e.name for e in entries if e.is_dir(follow_symlinks=False)]
 
         if not found_folders:
             print("No user subdirectories found in known_faces.")
@@ -22,12 +29,23 @@ def run():
         print(f"Found potential user folders: {', '.join(found_folders)}")
         added_count = 0
 
+        # Every placeholder user gets the same default password, so pay the
+        # ~250ms bcrypt cost once instead of once per folder. (The salt is
+        # embedded in the hash, so all rows share it - fine for throwaway
+        # credentials the user must change on first login.)
+        default_password_hash = pwd_context.hash(DEFAULT_TEMP_PASSWORD)
+
+        # Two bulk SELECTs up front instead of two queries per folder:
+        # membership checks inside the loop are then plain set lookups
+        existing_ids = {row[0] for row in db.session.query(User.id).all()}
+        existing_emails = {row[0] for row in db.session.query(User.email).all()}
+        new_users = []
+
         for folder_name in found_folders:
             # Assume folder name is the user ID (ideally a UUID)
             user_id = folder_name
-            existing_user = User.query.get(user_id)
 
-            if existing_user:
+            if user_id in existing_ids:
                 print(f"Skipping '{folder_name}': User already exists in database.")
                 continue
 
@@ -35,9 +53,7 @@ def run():
             print(f"Creating database entry for user ID: {user_id}...")
 
             # Basic validation (is it a UUID? optional)
-            try:
-                 uuid.UUID(user_id, version=4)
-            except ValueError:
+            if not _UUID4_RE.match(user_id):
                  print(f"  WARN: Folder name '{user_id}' is not a valid UUID. Skipping for safety.")
                  # Or you could generate a new UUID and rename folder? Risky.
                  continue
@@ -47,33 +63,30 @@ def run():
             email = f"{user_id}@neuralock.placeholder"
             name = user_id # Use ID as name initially, user can change via app
             role = "Family Member" # Default role
-            password_hash = pwd_context.hash(DEFAULT_TEMP_PASSWORD)
+            password_hash = default_password_hash
 
             # Check if placeholder email already exists (shouldn't if ID is unique)
-            if User.query.filter_by(email=email).first():
+            if email in existing_emails:
                  print(f"  WARN: Placeholder email '{email}' already exists. Skipping user '{user_id}'.")
                  continue
 
-            try:
-                new_user = User(
-                    id=user_id,
-                    email=email,
-                    name=name, # User should update this via profile screen
-                    password_hash=password_hash,
-                    role=role
-                    # Avatar will remain default for now
-                )
-                db.session.add(new_user)
-                print(f"  Added user '{name}' (ID: {user_id}) with placeholder details.")
-                added_count += 1
-
-            except Exception as e:
-                print(f"  ERROR adding user '{user_id}' to database session: {e}")
-                db.session.rollback() # Rollback this specific user on error
-
-        # Commit all successfully added users outside the loop
+            new_users.append(User(
+                id=user_id,
+                email=email,
+                name=name, # User should update this via profile screen
+                password_hash=password_hash,
+                role=role
+                # Avatar will remain default for now
+            ))
+            existing_ids.add(user_id); existing_emails.add(email)
+            print(f"  Added user '{name}' (ID: {user_id}) with placeholder details.")
+            added_count += 1
+
+        # Insert all new users in one statement + one commit, skipping the
+        # per-row ORM unit-of-work bookkeeping
         if added_count > 0:
             try:
+                db.session.bulk_save_objects(new_users)
                 db.session.commit()
                 print(f"\nSuccessfully added {added_count} users to the database.")
                 print(f"IMPORTANT: Default password is '{DEFAULT_TEMP_PASSWORD}'. Users must log in and change details.")
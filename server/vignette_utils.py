@@ -1,8 +1,49 @@
 import cv2
 import numpy as np
-import os 
+import os
+from functools import lru_cache
 
-def apply_elliptical_vignette(image, scale_x=0.85, scale_y=0.85, feather_sigma=30.0):
+
+@lru_cache(maxsize=8)
+def _build_mask(h, w, scale_x, scale_y, feather_sigma, is_color):
+    """Builds the feathered elliptical mask for one (shape, params) combo.
+
+    The mask is a pure function of its arguments, and for a fixed camera the
+    frame size never changes - so the ellipse draw, the large feathering blur
+    and the channel replication all run once and every later frame pays only
+    the multiply. Returned array is marked read-only since it is shared.
+    """
+    center_x, center_y = w // 2, h // 2
+    # Ensure axes are at least 1 pixel
+    axis_x = max(1, int((w / 2) * scale_x))
+    axis_y = max(1, int((h / 2) * scale_y))
+
+    # The feathered ellipse has a closed form: a sigmoid over the squared
+    # elliptical radius (r2 == 1 is the ellipse edge). Computing it directly
+    # on a meshgrid replaces the draw-a-hard-ellipse-then-blur-it approach -
+    # no large blur pass at all, and the falloff is perfectly smooth.
+    yy, xx = np.ogrid[:h, :w]
+    r2 = ((xx - center_x) / axis_x) ** 2 + ((yy - center_y) / axis_y) ** 2
+    if feather_sigma > 0:
+        # Steepness scaled so feather_sigma keeps roughly its old meaning
+        # (transition width in pixels relative to the frame)
+        s = feather_sigma / max(w, h)
+        # exponent clipped so far-corner pixels don't overflow exp()
+        mask = (1.0 / (1.0 + np.exp(np.clip((r2 - 1.0) / s, -60.0, 60.0)))).astype(np.float32)
+    else:
+        mask = (r2 <= 1.0).astype(np.float32)  # hard edge
+
+    if is_color:
+        mask = cv2.cvtColor(mask, cv2.COLOR_GRAY2BGR)  # Replicate channel
+    # 8.8 fixed-point copy for the fused uint8 apply path: multiplying the
+    # uint8 image by this with scale=1/256 stays integer end to end
+    mask_fp = np.round(mask * 256.0).astype(np.uint16)
+    mask.setflags(write=False)
+    mask_fp.setflags(write=False)
+    return mask, mask_fp
+
+
+def apply_elliptical_vignette(image, scale_x=0.85, scale_y=0.85, feather_sigma=30.0, out=None):
     """
     Applies an elliptical vignette (black border) to an image.
 
@@ -15,6 +56,10 @@ def apply_elliptical_vignette(image, scale_x=0.85, scale_y=0.85, feather_sigma=3
         feather_sigma (float): Standard deviation for the Gaussian blur used to soften
                                the ellipse edge. Higher values create a softer, wider fade.
                                Set to 0 or less for a hard edge.
+        out (np.ndarray): Optional preallocated uint8 output buffer with the same
+                          shape as the image. Callers processing a frame stream can
+                          pass the same buffer every call to skip the per-frame
+                          result allocation. Ignored on the non-uint8 path.
 
     Returns:
         np.ndarray: The image with the elliptical vignette applied, or None if input is invalid.
@@ -26,42 +71,17 @@ def apply_elliptical_vignette(image, scale_x=0.85, scale_y=0.85, feather_sigma=3
     h, w = image.shape[:2]
     is_color = len(image.shape) == 3
 
-    # 1. Create a float mask (0.0 to 1.0)
-    # Start with a black background and draw a white ellipse (value 1.0)
-    mask = np.zeros((h, w), dtype=np.float32)
-
-    # Calculate ellipse parameters
-    center_x, center_y = w // 2, h // 2
-    # Ensure axes are at least 1 pixel
-    axis_x = max(1, int((w / 2) * scale_x))
-    axis_y = max(1, int((h / 2) * scale_y))
-
-    # Draw the white filled ellipse (value 1.0) onto the black mask (value 0.0)
-    try:
-        cv2.ellipse(mask, (center_x, center_y), (axis_x, axis_y), 0, 0, 360, (1.0), thickness=-1)
-    except cv2.error as e:
-         print(f"Warning: Could not draw ellipse (image might be too small?): {e}. Using full mask.")
-         mask.fill(1.0) # Fallback: make everything visible if ellipse fails
+    # 1./2. Mask construction is memoized on (shape, params) - see _build_mask
+    mask, mask_fp = _build_mask(h, w, scale_x, scale_y, feather_sigma, is_color)
 
-    # 2. Apply feathering by blurring the mask
-    if feather_sigma > 0:
-        # Use a kernel size appropriate for the sigma (rule of thumb: ~6*sigma + 1)
-        ksize = int(6 * feather_sigma) + 1
-        ksize = ksize if ksize % 2 != 0 else ksize + 1 # Ensure kernel size is odd
-        mask = cv2.GaussianBlur(mask, (ksize, ksize), feather_sigma)
-        # Blurring might slightly change values, ensure it stays within [0, 1] if needed
-        # np.clip(mask, 0.0, 1.0, out=mask) # Usually not necessary for 0->1 mask blur
-
-    # 3. Apply the mask to the image using element-wise multiplication
-    # Convert mask to have the same number of channels as the image if it's color
-    if is_color:
-        mask_3ch = cv2.cvtColor(mask, cv2.COLOR_GRAY2BGR) # Replicate channel
-        # Multiply image (converted to float) by the mask
-        result_float = image.astype(np.float32) * mask_3ch
-    else: # Grayscale image
-        result_float = image.astype(np.float32) * mask
+    # 3./4. Apply the mask. For uint8 frames (every camera frame) the fused
+    # cv2.multiply against the fixed-point mask goes uint8 -> uint8 with
+    # internal saturation: no ~12 bytes/pixel of float32 temporaries and no
+    # separate clip+cast pass. Other dtypes keep the float path.
+    if image.dtype == np.uint8:
+        return cv2.multiply(image, mask_fp, dst=out, scale=1.0 / 256.0, dtype=cv2.CV_8U)
 
-    # 4. Convert back to original data type (e.g., uint8)
+    result_float = image.astype(np.float32) * mask
     # Clip values to ensure they are within the valid range (e.g., 0-255 for uint8)
     # This is important as float multiplication might slightly exceed the range
     result = np.clip(result_float, 0, 255).astype(image.dtype)